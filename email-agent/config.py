@@ -1,19 +1,42 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 class Settings(BaseSettings):
     # OpenAI
     OPENAI_API_KEY: str
+    PROMPT_MAX_TOKENS: int = 16000
+    PROMPT_MAX_CONTEXT_TOKENS: int = 4000
+    PROMPT_SUMMARY_TOKENS: int = 300
+    STREAM_FLUSH_INTERVAL_MS: int = 50
+    STREAM_FLUSH_CHUNKS: int = 40
+    # Pacing of OpenAI calls across all sessions. Unset rate limits are learned from OpenAI's rate-limit headers.
+    LLM_INITIAL_CONCURRENCY: int = 4
+    LLM_MIN_CONCURRENCY: int = 1
+    LLM_MAX_CONCURRENCY: int = 16
+    LLM_REQUESTS_PER_MINUTE: Optional[float] = None
+    LLM_TOKENS_PER_MINUTE: Optional[float] = None
+    LLM_MAX_RETRIES: int = 4
+    LLM_BACKOFF_BASE: float = 0.5
+    LLM_BACKOFF_MAX: float = 20.0
     
     # RecallrAI
     RECALLRAI_API_KEY: str
     RECALLRAI_PROJECT_ID: str
     RECALLRAI_USER_ID: str
+    # Contexts are also dropped as soon as the session list shows a newly processed session
+    CONTEXT_CACHE_TTL: int = 300
     
     # ACS
     ACS_EMAIL: str
     ACS_KEY: str
     ACS_ENDPOINT: str
+    EMAIL_OUTBOX_DB_PATH: str = "email_outbox.db"
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 5
+    EMAIL_OUTBOX_WORKERS: int = 4
+    EMAIL_SEND_RATE_PER_MINUTE: float = 30
+    # ACS allows at most 50 recipients per message, one of which is the sender in "to"
+    EMAIL_BULK_BATCH_SIZE: int = 49
 
     
     class Config:
@@ -1,68 +1,192 @@
+import logging
 import streamlit as st
 from openai import OpenAI
 from config import get_settings
 from recallrai import RecallrAI
 from recallrai.exceptions import UserNotFoundError, InvalidSessionStateError
-from recallrai.models import SessionStatus
+from recallrai.models import Context, SessionStatus, SessionList
 from datetime import datetime, timezone
-import json
-from utils.tools import send_email
-from utils.models import SendEmailRequest
+from typing import Any, Dict, List, Tuple
+from utils.tools import registry as tool_registry, outbox
+from utils.cache import SessionCache, ContextCache
+from utils.prompt import PromptTemplate, build_prompt, count_tokens
+from utils.llm_gateway import LLMGateway, cached_tokens
+from utils.streaming import StreamRenderer
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 # Setup Clients
-oai_client = OpenAI(
-    api_key=settings.OPENAI_API_KEY,
-)
-rai_client = RecallrAI(
-    api_key=settings.RECALLRAI_API_KEY,
-    project_id=settings.RECALLRAI_PROJECT_ID,
-)
+# Streamlit reruns this script on every interaction, so anything that costs a network call is cached across reruns
+@st.cache_resource
+def get_oai_client() -> OpenAI:
+    return OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+    )
 
-# Define the email tool for function calling
-tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "send_email",
-            "description": "Send an email to a recipient",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "email": {
-                        "type": "string",
-                        "description": "The email address of the recipient"
-                    },
-                    "subject": {
-                        "type": "string",
-                        "description": "The subject line of the email"
-                    },
-                    "body": {
-                        "type": "string",
-                        "description": "The body content of the email"
-                    }
-                },
-                "required": ["email", "subject", "body"],
-                "additionalProperties": False
-            },
-            "strict": True
-        }
-    }
-]
+@st.cache_resource
+def get_llm_gateway() -> LLMGateway:
+    """One gateway for all sessions, so concurrent chats share the OpenAI concurrency and rate limits"""
+    return LLMGateway(
+        get_oai_client(),
+        initial_concurrency=settings.LLM_INITIAL_CONCURRENCY,
+        min_concurrency=settings.LLM_MIN_CONCURRENCY,
+        max_concurrency=settings.LLM_MAX_CONCURRENCY,
+        requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+        max_retries=settings.LLM_MAX_RETRIES,
+        backoff_base=settings.LLM_BACKOFF_BASE,
+        backoff_max=settings.LLM_BACKOFF_MAX,
+    )
+
+@st.cache_resource
+def get_rai_client() -> RecallrAI:
+    return RecallrAI(
+        api_key=settings.RECALLRAI_API_KEY,
+        project_id=settings.RECALLRAI_PROJECT_ID,
+    )
+
+@st.cache_resource
+def get_user():
+    """Get the RecallrAI user, creating it on first run"""
+    try:
+        return get_rai_client().get_user(user_id=settings.RECALLRAI_USER_ID)
+    except UserNotFoundError:
+        return get_rai_client().create_user(
+            user_id=settings.RECALLRAI_USER_ID,
+            metadata={},
+        )
+
+@st.cache_data(ttl=30, show_spinner=False)
+def list_sessions(offset: int = 0, limit: int = 10) -> SessionList:
+    """Recent sessions of the user. Call `list_sessions.clear()` after anything that changes them."""
+    return get_user().list_sessions(offset=offset, limit=limit)
+
+llm = get_llm_gateway()
+
+# Tools the model can call, defined by the registry in utils/tools
+tools = tool_registry.schemas()
+
+# The tool schemas and these instructions are the same on every request and go first, the user's memories
+# after them, so OpenAI's prompt caching can reuse the prefix. Nothing per-user belongs in `instructions`.
+SYSTEM_PROMPT = PromptTemplate(
+    instructions="""You are a helpful assistant with memory of previous conversations.
+
+The memories about the user are given after these instructions. You can use them to provide better responses to the user.
+Don't mention that you have access to memories unless you are explicitly asked.
+
+You also have the ability to send emails. Use the send_email function when the user requests to send an email, or send_bulk_email to send the same email to several people.
+Emails are queued and delivered in the background; send_email returns a tracking id. If the user asks whether an email went out, use get_email_status with that tracking id.
+""",
+    memory_template="MEMORIES ABOUT THE USER:\n{context}",
+)
 
 # Get user
 try:
-    user = rai_client.get_user(user_id=settings.RECALLRAI_USER_ID)
-except UserNotFoundError as e:
-    user = rai_client.create_user(
-        user_id=settings.RECALLRAI_USER_ID,
-        metadata={},
-    )
+    user = get_user()
 except Exception as e:
     st.error(f"Error creating user: {str(e)}")
     st.stop()
 
+@st.cache_resource
+def get_session_cache() -> SessionCache:
+    """Session handles shared across reruns, so lookups skip the get_session round-trip"""
+    return SessionCache(auto_process_after_minutes=5, max_entries=100)
+
+def get_session(session_id: str):
+    """Get a session handle, from the cache when possible"""
+    session_cache = get_session_cache()
+    session = session_cache.get(str(session_id))
+    if session is None:
+        session = user.get_session(session_id=session_id)
+    session_cache.touch(str(session_id), session)
+    return session
+
+@st.cache_resource
+def get_context_cache() -> ContextCache:
+    """Contexts shared across reruns, so most messages skip the get_context round-trips"""
+    return ContextCache(ttl=settings.CONTEXT_CACHE_TTL, max_users=100)
+
+def get_context(session, force_refresh: bool = False) -> Tuple[Context, bool]:
+    """Context of the session, from the context cache unless `force_refresh`. Also returns whether it was cached."""
+    context_cache = get_context_cache()
+    context = None if force_refresh else context_cache.get(settings.RECALLRAI_USER_ID, session.session_id)
+    if context is not None:
+        return context, True
+    generation = context_cache.generation(settings.RECALLRAI_USER_ID)
+    context = session.get_context()
+    context_cache.set(settings.RECALLRAI_USER_ID, session.session_id, context, generation)
+    return context, False
+
+# Cap on model -> tool -> model round-trips per user message
+MAX_TOOL_ROUNDS = 5
+# Shown when the model produced no answer at all, e.g. after running out of tool rounds
+NO_ANSWER_MESSAGE = "Sorry, I couldn't finish that. Please try again or rephrase your request."
+
+def make_renderer(placeholder) -> StreamRenderer:
+    """Renderer that redraws the placeholder at a bounded rate instead of once per chunk"""
+    return StreamRenderer(
+        placeholder,
+        flush_interval=settings.STREAM_FLUSH_INTERVAL_MS / 1000,
+        flush_chunks=settings.STREAM_FLUSH_CHUNKS,
+    )
+
+def stream_completion(messages_for_api: List[Dict[str, Any]], renderer: StreamRenderer, allow_tools: bool = True) -> Dict[int, Dict[str, Any]]:
+    """Stream a completion into `renderer` and return the tool calls the model made, keyed by index"""
+    # Charge the prompt plus a typical answer against the token budget
+    estimated_tokens = sum(count_tokens(str(message.get("content") or "")) for message in messages_for_api) + 500
+    response = llm.create(
+        estimated_tokens=estimated_tokens,
+        model="gpt-4o-mini",
+        messages=messages_for_api,
+        tools=tools,
+        # Tools stay in the request either way, so the cached prompt prefix still matches
+        tool_choice="auto" if allow_tools else "none",
+        stream=True,
+        # Adds a final chunk with the usage, including how many prompt tokens were cached
+        stream_options={"include_usage": True},
+    )
+    renderer.queue_wait = response.queue_wait
+    
+    # Variables to accumulate the response
+    function_calls = {}
+    
+    # Process the streaming response
+    for chunk in response:
+        # The usage chunk has no choices
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        
+        # Handle regular content
+        if delta.content:
+            renderer.write(delta.content)
+        
+        # Handle tool calls
+        if delta.tool_calls:
+            for tool_call in delta.tool_calls:
+                index = tool_call.index
+                
+                if index not in function_calls:
+                    function_calls[index] = {
+                        "id": tool_call.id or "",
+                        "type": tool_call.type or "",
+                        "function": {
+                            "name": tool_call.function.name or "",
+                            "arguments": tool_call.function.arguments or ""
+                        }
+                    }
+                else:
+                    # Append arguments as they come in
+                    if tool_call.function.arguments:
+                        function_calls[index]["function"]["arguments"] += tool_call.function.arguments
+    
+    if response.usage is not None:
+        renderer.prompt_tokens = response.usage.prompt_tokens
+        renderer.cached_prompt_tokens = cached_tokens(response.usage)
+    
+    return function_calls
+
 # Streamlit UI setup
 st.set_page_config(page_title="RecallrAI Example - Email Agent", layout="wide")
 
@@ -71,6 +195,8 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "current_session_id" not in st.session_state:
     st.session_state.current_session_id = None
+if "refresh_context" not in st.session_state:
+    st.session_state.refresh_context = False
 
 # Main app layout
 col1, col2 = st.columns([1, 3])
@@ -85,21 +211,41 @@ with col1:
     if st.button("New Session"):
         # Create a session for the user
         new_session = user.create_session(auto_process_after_minutes=5)
+        get_session_cache().touch(str(new_session.session_id), new_session)
+        list_sessions.clear()
         st.session_state.current_session_id = new_session.session_id
         st.session_state.messages = []  # Clear messages for new session
         st.rerun()
     
     # Refresh sessions button
     if st.button("Refresh Sessions"):
+        list_sessions.clear()
+        # Also fetch the next context fresh, in case memories changed in ways the session list doesn't show
+        st.session_state.refresh_context = True
+        if st.session_state.current_session_id:
+            get_session_cache().invalidate(str(st.session_state.current_session_id))
+            session = user.get_session(session_id=st.session_state.current_session_id)
+            if session.get_status() != SessionStatus.PENDING:
+                st.session_state.current_session_id = None
+                st.session_state.messages = []
         st.rerun()
-        session = user.get_session(session_id=st.session_state.current_session_id)
-        if session.status != SessionStatus.PENDING:
-            st.session_state.current_session_id = None
-            st.session_state.messages = []
+    
+    # Delivery status of recently queued emails
+    with st.expander("Email Outbox"):
+        deliveries = outbox.recent(limit=10)
+        if not deliveries:
+            st.caption("No emails queued yet.")
+        for delivery in deliveries:
+            line = f"**{delivery.status}** · {', '.join(delivery.recipients)} · {delivery.subject}"
+            if delivery.last_error:
+                line += f"\n\nLast error (attempt {delivery.attempts}): {delivery.last_error}"
+            st.markdown(line)
     
     # List all available user sessions
     st.subheader("Previous Sessions")
-    session_list = user.list_sessions(offset=0, limit=10)
+    session_list = list_sessions(offset=0, limit=10)
+    # A session that reached PROCESSED changed the user's long-term memory, so cached contexts are stale
+    get_context_cache().sessions_seen(settings.RECALLRAI_USER_ID, [(session.session_id, session.status) for session in session_list.sessions])
     
     if not session_list.sessions:
         # If no sessions are available, show a message
@@ -123,8 +269,10 @@ with col1:
                 # Add Process Session button for pending sessions
                 if st.button(f"Process Session", key=f"process_{session.session_id}"):
                     try:
-                        session_obj = user.get_session(session_id=session.session_id)
+                        session_obj = get_session(session.session_id)
                         session_obj.process()
+                        get_session_cache().invalidate(str(session.session_id))
+                        list_sessions.clear()
                         st.success(f"Processing initiated for session {session.session_id}")
                         st.rerun()
                     except Exception as e:
@@ -156,6 +304,11 @@ with col2:
             if message.get("function_result"):
                 with st.expander("Function Result"):
                     st.write(message["function_result"])
+            
+            # Display streaming metrics if present
+            if message.get("stream_metrics"):
+                with st.expander("Response Metrics"):
+                    st.json(message["stream_metrics"])
     
     # Chat input
     if st.session_state.current_session_id:
@@ -171,9 +324,11 @@ with col2:
             
             # Add message to RecallrAI session
             try:
-                session = user.get_session(session_id=st.session_state.current_session_id)
+                session = get_session(st.session_state.current_session_id)
                 session.add_user_message(prompt)
             except InvalidSessionStateError as e:
+                get_session_cache().invalidate(st.session_state.current_session_id)
+                get_context_cache().memory_changed(settings.RECALLRAI_USER_ID)
                 st.error(f"The session you're trying to send a message to is expired. Please create a new session.")
             except Exception as e:
                 st.error(f"Unknown Recallr AI Error: {str(e)}")
@@ -185,103 +340,54 @@ with col2:
                 
                 # Get context from RecallrAI
                 try:
-                    context = session.get_context()
+                    context, context_cached = get_context(session, force_refresh=st.session_state.refresh_context)
+                    st.session_state.refresh_context = False
                     print(context)
                     
-                    # Create a system prompt with context
-                    system_prompt = f"""You are a helpful assistant with memory of previous conversations.
-                    
-                    MEMORIES ABOUT THE USER:
-                    {context.context}
-                    
-                    You can use the above memories to provide better responses to the user.
-                    Don't mention that you have access to memories unless you are explicitly asked.
-                    
-                    You also have the ability to send emails. Use the send_email function when the user requests to send an email.
-                    """
-                    
-                    # Get response from OpenAI with streaming and function calling
-                    messages_for_api = [
-                        {"role": "system", "content": system_prompt},
-                        *[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-                    ]
-                    
-                    response = oai_client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=messages_for_api,
-                        tools=tools,
-                        stream=True,
+                    # Create a system prompt with context, fitting context and history into the token budget
+                    prompt = build_prompt(
+                        SYSTEM_PROMPT,
+                        context.context,
+                        [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
+                        max_tokens=settings.PROMPT_MAX_TOKENS,
+                        max_context_tokens=settings.PROMPT_MAX_CONTEXT_TOKENS,
+                        summary_tokens=settings.PROMPT_SUMMARY_TOKENS,
                     )
+                    if prompt.trimmed_tokens:
+                        logger.info(f"Prompt trimmed by {prompt.trimmed_tokens} tokens ({prompt.dropped_messages} messages condensed), {prompt.prompt_tokens} tokens left")
                     
-                    # Variables to accumulate the response
-                    full_response = ""
-                    function_calls = {}
-                    
-                    # Process the streaming response
-                    for chunk in response:
-                        delta = chunk.choices[0].delta
-                        
-                        # Handle regular content
-                        if delta.content:
-                            full_response += delta.content
-                            message_placeholder.markdown(full_response + "▌")
-                        
-                        # Handle tool calls
-                        if delta.tool_calls:
-                            for tool_call in delta.tool_calls:
-                                index = tool_call.index
-                                
-                                if index not in function_calls:
-                                    function_calls[index] = {
-                                        "id": tool_call.id or "",
-                                        "type": tool_call.type or "",
-                                        "function": {
-                                            "name": tool_call.function.name or "",
-                                            "arguments": tool_call.function.arguments or ""
-                                        }
-                                    }
-                                else:
-                                    # Append arguments as they come in
-                                    if tool_call.function.arguments:
-                                        function_calls[index]["function"]["arguments"] += tool_call.function.arguments
+                    # Get response from OpenAI with streaming and function calling
+                    messages_for_api = prompt.messages
+                    renderer = make_renderer(message_placeholder)
+                    function_calls = stream_completion(messages_for_api, renderer)
                     
-                    # Process function calls if any
-                    if function_calls:
-                        function_call_info = list(function_calls.values())[0]
-                        function_name = function_call_info["function"]["name"]
-                        function_args = json.loads(function_call_info["function"]["arguments"])
+                    # Process function calls if any. The follow-up may call tools again, so keep going until it answers.
+                    tool_rounds = 0
+                    while function_calls and tool_rounds < MAX_TOOL_ROUNDS:
+                        tool_rounds += 1
+                        tool_calls = [function_calls[index] for index in sorted(function_calls)]
+                        function_names = ", ".join(f"`{call['function']['name']}`" for call in tool_calls)
                         
                         # Show function call info
-                        message_placeholder.markdown(f"**Function called**: `{function_name}`\n\nProcessing...")
+                        message_placeholder.markdown(f"**Function called**: {function_names}\n\nProcessing...")
                         
-                        # Execute the function
-                        if function_name == "send_email":
-                            try:
-                                email_request = SendEmailRequest(
-                                    email=function_args["email"],
-                                    subject=function_args["subject"],
-                                    body=function_args["body"]
-                                )
-                                result = send_email(email_request)
-                                function_result = f"Email sent successfully: {result}"
-                            except Exception as e:
-                                function_result = f"Error sending email: {str(e)}"
-                        else:
-                            function_result = f"Unknown function: {function_name}"
+                        # Execute every function the model called, concurrently
+                        function_results = tool_registry.run_all(tool_calls)
                         
-                        # Store function call and result
-                        function_call_msg = {
-                            "role": "assistant",
-                            "content": "",
-                            "function_call": function_call_info,
-                            "function_result": function_result
-                        }
-                        st.session_state.messages.append(function_call_msg)
+                        # Store function calls and results
+                        for function_call_info, function_result in zip(tool_calls, function_results):
+                            function_call_msg = {
+                                "role": "assistant",
+                                "content": "",
+                                "function_call": function_call_info,
+                                "function_result": function_result
+                            }
+                            st.session_state.messages.append(function_call_msg)
                         
                         # Add function call to RecallrAI session
                         # session.add_assistant_message(f"Function call: {function_name} with args: {function_args}")
                         
-                        # Call the model again with the function result
+                        # Call the model again with all the function results in one request
                         messages_for_api.append({
                             "role": "assistant",
                             "content": None,
@@ -289,37 +395,38 @@ with col2:
                                 "id": function_call_info["id"],
                                 "type": "function",
                                 "function": {
-                                    "name": function_name,
+                                    "name": function_call_info["function"]["name"],
                                     "arguments": function_call_info["function"]["arguments"]
                                 }
-                            }]
+                            } for function_call_info in tool_calls]
                         })
                         
-                        messages_for_api.append({
-                            "role": "tool",
-                            "tool_call_id": function_call_info["id"],
-                            "content": function_result
-                        })
-                        
-                        # Get final response from OpenAI
-                        final_response = oai_client.chat.completions.create(
-                            model="gpt-4o-mini",
-                            messages=messages_for_api,
-                        )
-                        
-                        final_content = final_response.choices[0].message.content
-                        message_placeholder.markdown(final_content)
-                        
-                        # Save to session state and RecallrAI
-                        st.session_state.messages.append({"role": "assistant", "content": final_content})
-                        session.add_assistant_message(final_content)
-                    else:
-                        # If no function calls, just display the regular response
-                        message_placeholder.markdown(full_response)
+                        for function_call_info, function_result in zip(tool_calls, function_results):
+                            messages_for_api.append({
+                                "role": "tool",
+                                "tool_call_id": function_call_info["id"],
+                                "content": function_result
+                            })
                         
+                        # Stream the follow-up response through a fresh renderer, so its metrics cover this request
+                        renderer = make_renderer(message_placeholder)
+                        function_calls = stream_completion(messages_for_api, renderer)
+                    
+                    if function_calls:
+                        # Out of tool rounds and the model still wants tools: have it answer from the results it has
+                        renderer = make_renderer(message_placeholder)
+                        stream_completion(messages_for_api, renderer, allow_tools=False)
+                    
+                    full_response = renderer.finish()
+                    
+                    if full_response.strip():
                         # Save the assistant's response to session state and RecallrAI session
-                        st.session_state.messages.append({"role": "assistant", "content": full_response})
+                        st.session_state.messages.append({"role": "assistant", "content": full_response, "stream_metrics": {**renderer.metrics(), "context_cached": context_cached}})
                         session.add_assistant_message(full_response)
+                    else:
+                        # Nothing worth remembering, just let the user know
+                        message_placeholder.markdown(NO_ANSWER_MESSAGE)
+                        st.session_state.messages.append({"role": "assistant", "content": NO_ANSWER_MESSAGE})
                 
                 except Exception as e:
                     error_message = f"Error: {str(e)}"
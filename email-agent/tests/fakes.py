@@ -0,0 +1,31 @@
+import threading
+import uuid
+from typing import Any, Dict, List
+
+class FakePoller:
+    def __init__(self, result: Dict[str, Any]):
+        self._result = result
+
+    def result(self) -> Dict[str, Any]:
+        return self._result
+
+class FakeEmailClient:
+    """
+    Local stand-in for the ACS `EmailClient`.
+
+    The first `failures` sends raise, the rest succeed and are recorded in `sent`.
+    """
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.attempts = 0
+        self.sent: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def begin_send(self, message: Dict[str, Any]) -> FakePoller:
+        with self._lock:
+            self.attempts += 1
+            if self.attempts <= self.failures:
+                raise RuntimeError(f"ACS unavailable (attempt {self.attempts})")
+            self.sent.append(message)
+        return FakePoller({"id": uuid.uuid4().hex, "status": "Succeeded"})
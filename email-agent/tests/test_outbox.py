@@ -0,0 +1,83 @@
+import os
+import tempfile
+import time
+import unittest
+from tests.fakes import FakeEmailClient
+from utils.outbox import EmailOutbox, EmailStatus
+
+def make_message(subject: str = "Hello") -> dict:
+    return {
+        "senderAddress": "bot@example.com",
+        "recipients": {"to": [{"address": "customer@example.com"}]},
+        "content": {"subject": subject, "plainText": "Hi there"},
+    }
+
+class EmailOutboxTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self._dir.name, "email_outbox.db")
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            outbox.stop()
+        self._dir.cleanup()
+
+    def make_outbox(self, client: FakeEmailClient, max_attempts: int = 3) -> EmailOutbox:
+        outbox = EmailOutbox(client, db_path=self.db_path, max_attempts=max_attempts, base_backoff=0.01, poll_interval=0.01)
+        self.outboxes.append(outbox)
+        return outbox
+
+    def wait_for(self, outbox: EmailOutbox, tracking_id: str, status: EmailStatus, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            delivery = outbox.status(tracking_id)
+            if delivery.status == status.value:
+                return delivery
+            time.sleep(0.01)
+        self.fail(f"{tracking_id} is {outbox.status(tracking_id).status}, expected {status.value}")
+
+    def test_enqueue_persists_without_sending(self):
+        client = FakeEmailClient()
+        outbox = self.make_outbox(client)
+        tracking_id = outbox.enqueue(make_message("Welcome"))
+        delivery = outbox.status(tracking_id)
+        self.assertEqual(delivery.status, EmailStatus.QUEUED.value)
+        self.assertEqual(delivery.subject, "Welcome")
+        self.assertEqual(delivery.recipients, ["customer@example.com"])
+        self.assertEqual(client.attempts, 0)
+
+    def test_retries_until_sent(self):
+        client = FakeEmailClient(failures=2)
+        outbox = self.make_outbox(client)
+        outbox.start()
+        delivery = self.wait_for(outbox, outbox.enqueue(make_message()), EmailStatus.SENT)
+        self.assertEqual(delivery.attempts, 3)
+        self.assertIsNone(delivery.last_error)
+        self.assertEqual(len(client.sent), 1)
+
+    def test_fails_after_max_attempts(self):
+        client = FakeEmailClient(failures=10)
+        outbox = self.make_outbox(client, max_attempts=3)
+        outbox.start()
+        delivery = self.wait_for(outbox, outbox.enqueue(make_message()), EmailStatus.FAILED)
+        self.assertEqual(delivery.attempts, 3)
+        self.assertIn("ACS unavailable", delivery.last_error)
+        self.assertEqual(client.sent, [])
+
+    def test_requeues_sending_rows_on_restart(self):
+        crashed = self.make_outbox(FakeEmailClient())
+        tracking_id = crashed.enqueue(make_message())
+        # Claimed by a sender that died before finishing
+        crashed._claim_due()
+        self.assertEqual(crashed.status(tracking_id).status, EmailStatus.SENDING.value)
+
+        client = FakeEmailClient()
+        restarted = self.make_outbox(client)
+        self.assertEqual(restarted.status(tracking_id).status, EmailStatus.QUEUED.value)
+        restarted.start()
+        self.wait_for(restarted, tracking_id, EmailStatus.SENT)
+        self.assertEqual(len(client.sent), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,25 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class SendEmailRequest(BaseModel):
-    email: str
+    email: str = Field(..., description="The email address of the recipient")
+    subject: str = Field(..., description="The subject line of the email")
+    body: str = Field(..., description="The body content of the email")
+
+class SendBulkEmailRequest(BaseModel):
+    emails: List[str] = Field(..., description="The email addresses of all recipients")
+    subject: str = Field(..., description="The subject line of the email")
+    body: str = Field(..., description="The body content of the email")
+
+class GetEmailStatusRequest(BaseModel):
+    tracking_id: str = Field(..., description="The tracking id returned when the email was queued")
+
+class EmailDelivery(BaseModel):
+    tracking_id: str
+    recipients: List[str]
     subject: str
-    body: str
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: float
+    updated_at: float
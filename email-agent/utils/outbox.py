@@ -0,0 +1,182 @@
+import enum
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from utils.models import EmailDelivery
+from utils.rate_limit import TokenBucket
+
+class EmailStatus(str, enum.Enum):
+    QUEUED = "queued"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+class EmailOutbox:
+    """
+    Durable outbox for outgoing emails.
+
+    `enqueue` stores the ACS message in SQLite and returns a tracking id right away.
+    `workers` background threads send due messages through one shared `EmailClient` (so
+    its HTTP connections are reused), paced to at most `rate_per_minute` ACS requests, and
+    retry failures with jittered exponential backoff until `max_attempts`, after which the
+    email is marked failed. Messages left mid-send by a
+    crash are picked up again on the next start. `client` only needs a `begin_send`
+    method returning a poller, so a local fake can stand in for ACS.
+    """
+
+    def __init__(
+        self,
+        client,
+        db_path: str = "email_outbox.db",
+        max_attempts: int = 5,
+        base_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        poll_interval: float = 1.0,
+        workers: int = 1,
+        rate_per_minute: Optional[float] = None,
+    ):
+        self._client = client
+        self._max_attempts = max_attempts
+        self._base_backoff = base_backoff
+        self._max_backoff = max_backoff
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._workers = workers
+        self._threads: List[threading.Thread] = []
+        self._rate_limiter = TokenBucket(rate_per_minute / 60, max(1.0, rate_per_minute / 60)) if rate_per_minute else None
+        self._db = sqlite3.connect(db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS emails ("
+            "tracking_id TEXT PRIMARY KEY, message TEXT NOT NULL, status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, last_error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS emails_due ON emails (status, next_attempt_at)")
+        # Whatever was being sent when the process died goes back in the queue
+        self._db.execute(
+            "UPDATE emails SET status = ? WHERE status = ?",
+            (EmailStatus.QUEUED.value, EmailStatus.SENDING.value),
+        )
+
+    def enqueue(self, message: Dict[str, Any]) -> str:
+        """Persist an ACS email message for delivery and return its tracking id"""
+        return self.enqueue_many([message])[0]
+
+    def enqueue_many(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """Persist several ACS email messages in one transaction and return their tracking ids"""
+        tracking_ids = [uuid.uuid4().hex for _ in messages]
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT INTO emails (tracking_id, message, status, next_attempt_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (tracking_id, json.dumps(message), EmailStatus.QUEUED.value, now, now, now)
+                        for tracking_id, message in zip(tracking_ids, messages)
+                    ],
+                )
+        self._wakeup.set()
+        return tracking_ids
+
+    def status(self, tracking_id: str) -> Optional[EmailDelivery]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM emails WHERE tracking_id = ?", (tracking_id,)).fetchone()
+        return self._to_delivery(row) if row else None
+
+    def recent(self, limit: int = 10) -> List[EmailDelivery]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM emails ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_delivery(row) for row in rows]
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for index in range(self._workers):
+            thread = threading.Thread(target=self._run, name=f"email-outbox-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            row = self._claim_due()
+            if row is None:
+                self._wakeup.wait(self._poll_interval)
+                continue
+            self._deliver(row)
+
+    def _claim_due(self) -> Optional[sqlite3.Row]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM emails WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+                (EmailStatus.QUEUED.value, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE emails SET status = ?, updated_at = ? WHERE tracking_id = ?",
+                (EmailStatus.SENDING.value, time.time(), row["tracking_id"]),
+            )
+        return row
+
+    def _deliver(self, row: sqlite3.Row) -> None:
+        attempts = row["attempts"] + 1
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        try:
+            poller = self._client.begin_send(json.loads(row["message"]))
+            result = poller.result()
+            if result["status"] != "Succeeded":
+                raise RuntimeError(f"ACS send finished with status {result['status']}")
+        except Exception as e:
+            if attempts >= self._max_attempts:
+                self._update(row["tracking_id"], EmailStatus.FAILED, attempts, time.time(), str(e))
+            else:
+                backoff = min(self._max_backoff, self._base_backoff * 2 ** (attempts - 1))
+                next_attempt_at = time.time() + backoff * random.uniform(0.5, 1.0)
+                self._update(row["tracking_id"], EmailStatus.QUEUED, attempts, next_attempt_at, str(e))
+            return
+        self._update(row["tracking_id"], EmailStatus.SENT, attempts, time.time(), None)
+
+    def _update(self, tracking_id: str, status: EmailStatus, attempts: int, next_attempt_at: float, last_error: Optional[str]) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE emails SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE tracking_id = ?",
+                (status.value, attempts, next_attempt_at, last_error, time.time(), tracking_id),
+            )
+
+    @staticmethod
+    def _to_delivery(row: sqlite3.Row) -> EmailDelivery:
+        message = json.loads(row["message"])
+        return EmailDelivery(
+            tracking_id=row["tracking_id"],
+            recipients=[
+                recipient["address"]
+                for field in ("to", "cc", "bcc")
+                for recipient in message["recipients"].get(field, [])
+            ],
+            subject=message["content"]["subject"],
+            status=row["status"],
+            attempts=row["attempts"],
+            last_error=row["last_error"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+        )
@@ -0,0 +1,75 @@
+import time
+from typing import Any, Dict, List, Optional
+
+class StreamRenderer:
+    """
+    Renders a streamed completion into a Streamlit placeholder at a bounded rate.
+
+    Chunks are buffered in a list and the placeholder is only redrawn every
+    `flush_interval` seconds or every `flush_chunks` chunks, whichever comes first, instead
+    of once per chunk. `finish` always does a final flush without the cursor. Timing is
+    measured from construction, so create the renderer right before sending the request.
+    """
+
+    def __init__(self, placeholder, flush_interval: float = 0.05, flush_chunks: int = 40, cursor: str = "▌"):
+        self._placeholder = placeholder
+        self._flush_interval = flush_interval
+        self._flush_chunks = flush_chunks
+        self._cursor = cursor
+        self._parts: List[str] = []
+        self._text = ""
+        self._pending = 0
+        self._started_at = time.perf_counter()
+        self._last_flush = self._started_at
+        self._first_token_at: Optional[float] = None
+        self._render_seconds = 0.0
+        self._flushes = 0
+        self._chunks = 0
+        # Time the request spent waiting in the LLM gateway, if known
+        self.queue_wait: Optional[float] = None
+        # Prompt size and how much of it OpenAI served from its prompt cache, if the stream reported usage
+        self.prompt_tokens: Optional[int] = None
+        self.cached_prompt_tokens: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        if self._parts:
+            self._text += "".join(self._parts)
+            self._parts = []
+        return self._text
+
+    def write(self, chunk: str) -> None:
+        now = time.perf_counter()
+        if self._first_token_at is None:
+            self._first_token_at = now
+        self._parts.append(chunk)
+        self._pending += 1
+        self._chunks += 1
+        if self._pending >= self._flush_chunks or now - self._last_flush >= self._flush_interval:
+            self._flush(self.text + self._cursor)
+
+    def finish(self) -> str:
+        """Draw the complete text and return it"""
+        text = self.text
+        self._flush(text)
+        return text
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "time_to_first_token_ms": round((self._first_token_at - self._started_at) * 1000, 1) if self._first_token_at else None,
+            "total_ms": round((time.perf_counter() - self._started_at) * 1000, 1),
+            "render_ms": round(self._render_seconds * 1000, 1),
+            "chunks": self._chunks,
+            "flushes": self._flushes,
+            "queue_wait_ms": round(self.queue_wait * 1000, 1) if self.queue_wait is not None else None,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+        }
+
+    def _flush(self, text: str) -> None:
+        started = time.perf_counter()
+        self._placeholder.markdown(text)
+        self._last_flush = time.perf_counter()
+        self._render_seconds += self._last_flush - started
+        self._pending = 0
+        self._flushes += 1
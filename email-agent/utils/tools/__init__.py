@@ -1,5 +1,12 @@
-from .send_email import send_email
+from .registry import Tool, ToolRegistry, registry
+from .send_email import send_email, send_bulk_email, get_email_status, outbox
 
 __all__ = [
-    "send_email"
+    "Tool",
+    "ToolRegistry",
+    "registry",
+    "send_email",
+    "send_bulk_email",
+    "get_email_status",
+    "outbox"
 ]
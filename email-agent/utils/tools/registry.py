@@ -0,0 +1,117 @@
+import asyncio
+import inspect
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Type
+from pydantic import BaseModel, ValidationError
+
+def _strict_schema(schema: Any) -> Any:
+    """Turn a Pydantic JSON schema into one accepted by OpenAI strict function calling"""
+    if isinstance(schema, dict):
+        strict = {}
+        for key, value in schema.items():
+            if key in ("title", "default"):
+                continue
+            if key in ("properties", "$defs"):
+                # Keys here are property/definition names, not schema keywords
+                strict[key] = {name: _strict_schema(subschema) for name, subschema in value.items()}
+            else:
+                strict[key] = _strict_schema(value)
+        if strict.get("type") == "object" and "properties" in strict:
+            strict["required"] = list(strict["properties"])
+            strict["additionalProperties"] = False
+        return strict
+    if isinstance(schema, list):
+        return [_strict_schema(value) for value in schema]
+    return schema
+
+class Tool:
+    """A function the model can call: its name, argument model, handler and timeout"""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        args_model: Type[BaseModel],
+        handler: Callable[[BaseModel], Any],
+        timeout: float = 30.0,
+    ):
+        self.name = name
+        self.description = description
+        self.args_model = args_model
+        self.handler = handler
+        self.timeout = timeout
+
+    def schema(self) -> Dict[str, Any]:
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": _strict_schema(self.args_model.model_json_schema()),
+                "strict": True,
+            },
+        }
+
+class ToolRegistry:
+    """
+    Maps tool names to their schema, argument model and handler.
+
+    Handlers take the validated argument model and may be sync or async. All tool calls of
+    one model turn run concurrently, each under its own timeout, and every call gets a
+    result string back, including failures, so the model can see what went wrong.
+
+    Sync handlers run on the registry's own thread pool rather than the loop's default
+    executor, which `asyncio.run` waits for on exit: a sync handler that times out keeps
+    its thread until it returns, but no longer holds up `run_all`.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._tools: Dict[str, Tool] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def register(self, name: str, description: str, args_model: Type[BaseModel], timeout: float = 30.0):
+        """Decorator that registers a function as a tool"""
+        def decorator(handler: Callable[[BaseModel], Any]):
+            self._tools[name] = Tool(name, description, args_model, handler, timeout)
+            return handler
+        return decorator
+
+    def schemas(self) -> List[Dict[str, Any]]:
+        """Tool definitions for the `tools` parameter of a chat completion"""
+        return [tool.schema() for tool in self._tools.values()]
+
+    def run_all(self, tool_calls: List[Dict[str, Any]]) -> List[str]:
+        """Blocking entry point for sync callers such as the Streamlit script"""
+        return asyncio.run(self.execute_all(tool_calls))
+
+    async def execute_all(self, tool_calls: List[Dict[str, Any]]) -> List[str]:
+        """Run every tool call concurrently and return their results in the same order"""
+        return await asyncio.gather(*(self.execute(tool_call) for tool_call in tool_calls))
+
+    async def execute(self, tool_call: Dict[str, Any]) -> str:
+        name = tool_call["function"]["name"]
+        tool = self._tools.get(name)
+        if tool is None:
+            return f"Unknown function: {name}"
+        
+        try:
+            args = tool.args_model.model_validate_json(tool_call["function"]["arguments"] or "{}")
+        except ValidationError as e:
+            return f"Invalid arguments for {name}: {e}"
+        
+        try:
+            if inspect.iscoroutinefunction(tool.handler):
+                result = await asyncio.wait_for(tool.handler(args), tool.timeout)
+            else:
+                result = await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(self._executor, tool.handler, args), tool.timeout
+                )
+        except asyncio.TimeoutError:
+            return f"Error running {name}: timed out after {tool.timeout}s"
+        except Exception as e:
+            return f"Error running {name}: {str(e)}"
+        
+        return result if isinstance(result, str) else json.dumps(result, default=str)
+
+registry = ToolRegistry()
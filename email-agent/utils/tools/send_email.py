@@ -1,6 +1,9 @@
+from typing import Any, Dict, List, Optional
 from azure.communication.email import EmailClient
 from azure.core.credentials import AzureKeyCredential
-from utils.models import SendEmailRequest
+from utils.models import SendEmailRequest, SendBulkEmailRequest, GetEmailStatusRequest
+from utils.outbox import EmailOutbox
+from utils.tools.registry import registry
 from config import get_settings
 
 settings = get_settings()
@@ -11,19 +14,80 @@ acs_client = EmailClient(
     credential=credential
 )
 
-def send_email(data: SendEmailRequest) -> bool:
-    message = {
+# Emails are delivered by background senders, so the caller never waits on ACS
+outbox = EmailOutbox(
+    acs_client,
+    db_path=settings.EMAIL_OUTBOX_DB_PATH,
+    max_attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+    workers=settings.EMAIL_OUTBOX_WORKERS,
+    rate_per_minute=settings.EMAIL_SEND_RATE_PER_MINUTE,
+)
+outbox.start()
+
+def build_message(subject: str, body: str, to: List[str], bcc: Optional[List[str]] = None) -> Dict[str, Any]:
+    recipients = {"to": [{"address": address} for address in to]}
+    if bcc:
+        recipients["bcc"] = [{"address": address} for address in bcc]
+    return {
         "senderAddress": settings.ACS_EMAIL,
-        "recipients": {
-            "to": [{"address": data.email}]
-        },
+        "recipients": recipients,
         "content": {
-            "subject": data.subject,
-            "plainText": data.body,
+            "subject": subject,
+            "plainText": body,
         }
     }
+
+@registry.register(
+    name="send_email",
+    description="Send an email to a recipient. The email is queued for delivery and a tracking id is returned.",
+    args_model=SendEmailRequest,
+)
+def send_email(data: SendEmailRequest) -> Dict[str, Any]:
+    tracking_id = outbox.enqueue(build_message(data.subject, data.body, to=[data.email]))
+    
+    return {"tracking_id": tracking_id, "status": "queued"}
+
+@registry.register(
+    name="send_bulk_email",
+    description=(
+        "Send the same email to many recipients at once, e.g. a whole team. "
+        "Recipients are blind-copied so they don't see each other. Prefer this over repeated send_email calls."
+    ),
+    args_model=SendBulkEmailRequest,
+)
+def send_bulk_email(data: SendBulkEmailRequest) -> Dict[str, Any]:
+    # Case-insensitive de-duplication, keeping the order the model gave
+    emails, seen = [], set()
+    for email in (email.strip() for email in data.emails):
+        if email and email.lower() not in seen:
+            seen.add(email.lower())
+            emails.append(email)
     
-    poller = acs_client.begin_send(message)
-    result = poller.result()
+    # One ACS message per batch, addressed to the sender with the batch in bcc
+    batch_size = settings.EMAIL_BULK_BATCH_SIZE
+    batches = [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+    tracking_ids = outbox.enqueue_many([
+        build_message(data.subject, data.body, to=[settings.ACS_EMAIL], bcc=batch)
+        for batch in batches
+    ])
     
-    return result["status"] == "Succeeded"
+    return {
+        "status": "queued",
+        "batches": len(batches),
+        "results": [
+            {"email": email, "tracking_id": tracking_id, "status": "queued"}
+            for batch, tracking_id in zip(batches, tracking_ids)
+            for email in batch
+        ]
+    }
+
+@registry.register(
+    name="get_email_status",
+    description="Look up the delivery status of an email that was queued with send_email or send_bulk_email",
+    args_model=GetEmailStatusRequest,
+)
+def get_email_status(data: GetEmailStatusRequest) -> Dict[str, Any]:
+    delivery = outbox.status(data.tracking_id)
+    if delivery is None:
+        return {"tracking_id": data.tracking_id, "status": "unknown"}
+    return delivery.model_dump(include={"tracking_id", "status", "attempts", "last_error"})
@@ -0,0 +1,255 @@
+"""
+Load driver for the bot's /webhook endpoint.
+
+Generates WATI-shaped `WebhookData` traffic: Poisson arrivals across many phone numbers,
+bursts of several messages from one number, and WATI-style redeliveries of the same
+webhook. Replies are read back from the stub WATI server and matched with the messages
+that caused them.
+"""
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+import httpx
+from pydantic import BaseModel, Field
+
+class TrafficConfig(BaseModel):
+    phones: int = 100
+    messages: int = 1000
+    rate: float = 20.0
+    burst_probability: float = 0.2
+    burst_size: int = 3
+    burst_gap_ms: float = 300.0
+    retry_probability: float = 0.1
+    retry_delay_ms: float = 2000.0
+    max_retries: int = 3
+    settle_timeout: float = 30.0
+    # Share of messages that are one of FAQ_QUESTIONS instead of a unique question
+    faq_share: float = 0.0
+
+class SentMessage(BaseModel):
+    """One logical WhatsApp message and every delivery of its webhook"""
+    phone_number: str
+    payload: Dict[str, Any]
+    scheduled_at: float
+    deliveries: List[float] = Field(default_factory=list)
+    first_sent_at: Optional[float] = None
+    ack_ms: List[float] = Field(default_factory=list)
+    ack_status: List[str] = Field(default_factory=list)
+
+# Rewordings of the questions support sees most, in the way customers type them
+FAQ_QUESTIONS = [
+    "What time is check-in?",
+    "what is the check in time",
+    "What's the check-in time?",
+    "What is your cancellation policy?",
+    "what is the cancellation policy",
+    "When will I get my refund?",
+    "when will i get my refund??",
+    "Is breakfast included?",
+    "is breakfast included in the stay",
+]
+
+def phone_numbers(count: int) -> List[str]:
+    return [f"9199{index:08d}" for index in range(count)]
+
+def webhook_payload(phone_number: str, text: str) -> Dict[str, Any]:
+    message_id = uuid.uuid4().hex
+    return {
+        "id": message_id,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "whatsappMessageId": f"wamid.{message_id}",
+        "conversationId": phone_number,
+        "ticketId": phone_number,
+        "text": text,
+        "type": "text",
+        "timestamp": str(int(time.time())),
+        "owner": False,
+        "eventType": "message",
+        "statusString": "SENT",
+        "waId": phone_number,
+        "senderName": f"Load {phone_number[-4:]}",
+        "sourceType": 0,
+    }
+
+def schedule(config: TrafficConfig) -> List[SentMessage]:
+    """Lay out first deliveries and redeliveries on a timeline starting at 0"""
+    phones = phone_numbers(config.phones)
+    messages: List[SentMessage] = []
+    now = 0.0
+    while len(messages) < config.messages:
+        now += random.expovariate(config.rate)
+        phone_number = random.choice(phones)
+        size = random.randint(2, config.burst_size) if random.random() < config.burst_probability else 1
+        for index in range(min(size, config.messages - len(messages))):
+            at = now + index * config.burst_gap_ms / 1000
+            if random.random() < config.faq_share:
+                text = random.choice(FAQ_QUESTIONS)
+            else:
+                text = f"Hi, question {len(messages)} about my booking"
+            message = SentMessage(
+                phone_number=phone_number,
+                payload=webhook_payload(phone_number, text),
+                scheduled_at=at,
+            )
+            message.deliveries.append(at)
+            retries = 0
+            while retries < config.max_retries and random.random() < config.retry_probability:
+                retries += 1
+                message.deliveries.append(at + retries * config.retry_delay_ms / 1000)
+            messages.append(message)
+    return messages
+
+async def deliver(client: httpx.AsyncClient, message: SentMessage, delay: float) -> None:
+    await asyncio.sleep(max(0.0, delay))
+    started = time.time()
+    if message.first_sent_at is None:
+        message.first_sent_at = started
+    try:
+        response = await client.post("/webhook", json=message.payload)
+        status = response.json().get("status", str(response.status_code)) if response.status_code == 200 else str(response.status_code)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    message.ack_ms.append((time.time() - started) * 1000)
+    message.ack_status.append(status)
+
+async def sample_health(client: httpx.AsyncClient, samples: List[Dict[str, Any]], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            response = await client.get("/health")
+            samples.append(response.json())
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+async def fetch_replies(stub: httpx.AsyncClient) -> List[Dict[str, Any]]:
+    return (await stub.get("/_stub/replies")).json()["replies"]
+
+def unanswered(messages: List[SentMessage], replies: List[Dict[str, Any]]) -> int:
+    """Messages with no reply to their phone number sent after them (coalesced bursts share one reply)"""
+    last_reply: Dict[str, float] = {}
+    for reply in replies:
+        last_reply[reply["phone_number"]] = max(reply["at"], last_reply.get(reply["phone_number"], 0.0))
+    return sum(
+        1 for message in messages
+        if message.first_sent_at is None or last_reply.get(message.phone_number, 0.0) < message.first_sent_at
+    )
+
+async def run_load(target: str, stub_url: str, config: TrafficConfig) -> Dict[str, Any]:
+    messages = schedule(config)
+    limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=30) as client, \
+            httpx.AsyncClient(base_url=stub_url, timeout=30) as stub:
+        await stub.post("/_stub/reset")
+        health: List[Dict[str, Any]] = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_health(client, health, stop))
+
+        started = time.time()
+        await asyncio.gather(*(
+            deliver(client, message, at - (time.time() - started))
+            for message in messages
+            for at in message.deliveries
+        ))
+        sent_done = time.time()
+
+        # Wait for replies to stop arriving
+        replies = await fetch_replies(stub)
+        last_change = time.time()
+        while unanswered(messages, replies) and time.time() - last_change < config.settle_timeout:
+            await asyncio.sleep(0.5)
+            latest = await fetch_replies(stub)
+            if len(latest) != len(replies):
+                last_change = time.time()
+            replies = latest
+
+        stop.set()
+        await sampler
+        final_health = (await client.get("/health")).json()
+    return summarize(messages, replies, health, final_health, started, sent_done)
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 1)
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": round(max(values), 1) if values else 0.0,
+    }
+
+def summarize(
+    messages: List[SentMessage],
+    replies: List[Dict[str, Any]],
+    health: List[Dict[str, Any]],
+    final_health: Dict[str, Any],
+    started: float,
+    sent_done: float,
+) -> Dict[str, Any]:
+    by_context = {message.payload["whatsappMessageId"]: message for message in messages}
+    replies_per_context = Counter(reply["reply_context_id"] for reply in replies)
+    end_to_end_ms = [
+        (reply["at"] - by_context[reply["reply_context_id"]].first_sent_at) * 1000
+        for reply in replies
+        if reply["reply_context_id"] in by_context
+    ]
+    acks = [ack for message in messages for ack in message.ack_ms]
+    statuses = Counter(status for message in messages for status in message.ack_status)
+    last_reply_at = max((reply["at"] for reply in replies), default=sent_done)
+    elapsed = max(last_reply_at, sent_done) - started
+    missing = unanswered(messages, replies)
+    lag = [sample["event_loop"]["lag_ms"] for sample in health if sample.get("event_loop")]
+    per_phone = defaultdict(int)
+    for reply in replies:
+        per_phone[reply["phone_number"]] += 1
+    return {
+        "messages": len(messages),
+        "webhooks": sum(len(message.deliveries) for message in messages),
+        "ack_status": dict(statuses),
+        "replies": len(replies),
+        "duplicate_replies": sum(count - 1 for count in replies_per_context.values() if count > 1),
+        "unanswered_messages": missing,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_msgs_per_s": round((len(messages) - missing) / elapsed, 2) if elapsed else 0.0,
+        "replies_per_s": round(len(replies) / elapsed, 2) if elapsed else 0.0,
+        "ack_latency_ms": distribution(acks),
+        "end_to_end_latency_ms": distribution(end_to_end_ms),
+        "event_loop_lag_ms": {
+            **distribution(lag),
+            "max_reported": max((sample["event_loop"]["max_ms"] for sample in health if sample.get("event_loop")), default=0.0),
+        },
+        "phones_answered": len(per_phone),
+        "queue": final_health.get("queue"),
+        "scheduler": final_health.get("scheduler"),
+        "llm": final_health.get("llm"),
+        "memory": final_health.get("memory"),
+        "context_cache": final_health.get("context_cache"),
+        "reply_outbox": final_health.get("replies"),
+        "answer_cache": final_health.get("answer_cache"),
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\nMessages: {report['messages']} ({report['webhooks']} webhook deliveries incl. retries)")
+    print(f"Ack status: {report['ack_status']}")
+    print(f"Replies: {report['replies']} to {report['phones_answered']} phones, "
+          f"duplicates: {report['duplicate_replies']}, unanswered messages: {report['unanswered_messages']}")
+    print(f"Elapsed: {report['elapsed_s']}s, throughput: {report['throughput_msgs_per_s']} msgs/s, {report['replies_per_s']} replies/s")
+    for name in ("ack_latency_ms", "end_to_end_latency_ms", "event_loop_lag_ms"):
+        values = report[name]
+        print(f"{name:>24}: " + "  ".join(f"{key} {value}" for key, value in values.items()))
+    print(f"Queue: {report['queue']}")
+    print(f"Scheduler: {report['scheduler']}")
+    print(f"LLM: {report['llm']}")
+    print(f"Memory: {report['memory']}")
+    print(f"Context cache: {report['context_cache']}")
+    print(f"Reply outbox: {report['reply_outbox']}")
+    print(f"Answer cache: {report['answer_cache']}")
@@ -0,0 +1,123 @@
+"""
+Offline load test for the WhatsApp bot.
+
+Starts the upstream stubs and the bot as subprocesses (unless --stub-url / --target point
+at already running ones), drives /webhook traffic and prints a report:
+
+    python -m benchmarks.run --phones 200 --messages 2000 --rate 50 --openai-latency-ms 900
+
+Bot settings can be overridden with --bot-env, e.g. --bot-env WORKER_COUNT=32.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List
+import httpx
+from benchmarks.load import TrafficConfig, phone_numbers, print_report, run_load
+from benchmarks.stubs import PROFILE_FIELDS, add_profile_arguments
+
+BOT_DIR = Path(__file__).resolve().parent.parent
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Load test the bot against local upstream stubs")
+    parser.add_argument("--target", help="URL of an already running bot, otherwise one is started")
+    parser.add_argument("--stub-url", help="URL of already running stubs, otherwise they are started")
+    parser.add_argument("--bot-port", type=int, default=9000)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--bot-env", action="append", default=[], metavar="KEY=VALUE", help="extra bot setting")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    for name, default in TrafficConfig.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default.default), default=default.default)
+    add_profile_arguments(parser, "wati", 80)
+    add_profile_arguments(parser, "openai", 700, error_status=429)
+    add_profile_arguments(parser, "recallrai", 120)
+    return parser
+
+@contextmanager
+def process(name: str, command: List[str], env: Dict[str, str], log_dir: Path) -> Iterator[None]:
+    log_path = log_dir / f"{name}.log"
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(command, cwd=BOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            yield
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    print(f"{name} log: {log_path}")
+
+def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def bot_environment(args: argparse.Namespace, stub_url: str) -> Dict[str, str]:
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-stub",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "RECALLRAI_API_KEY": "rai_stub",
+        "RECALLRAI_PROJECT_ID": "stub",
+        "RECALLRAI_BASE_URL": stub_url,
+        "WATI_API_TOKEN": "Bearer stub",
+        "WATI_BASE_URL": f"{stub_url}/wati",
+        "ALLOWED_PHONE_NUMBERS": json.dumps(phone_numbers(args.phones)),
+    }
+    for override in args.bot_env:
+        key, _, value = override.partition("=")
+        env[key] = value
+    return env
+
+def stub_arguments(args: argparse.Namespace) -> List[str]:
+    return [
+        f"--{name}-{field.replace('_', '-')}={getattr(args, f'{name}_{field}')}"
+        for name in ("wati", "openai", "recallrai")
+        for field in PROFILE_FIELDS
+    ]
+
+def main() -> None:
+    args = build_parser().parse_args()
+    config = TrafficConfig(**{name: getattr(args, name) for name in TrafficConfig.model_fields})
+    log_dir = Path(tempfile.mkdtemp(prefix="wa-bot-bench-"))
+
+    stub_url = args.stub_url or f"http://127.0.0.1:{args.stub_port}"
+    stubs = nullcontext() if args.stub_url else process(
+        "stubs",
+        [sys.executable, "-m", "benchmarks.stubs", "--port", str(args.stub_port), *stub_arguments(args)],
+        dict(os.environ),
+        log_dir,
+    )
+    with stubs:
+        wait_until_up(f"{stub_url}/_stub/replies")
+        target = args.target or f"http://127.0.0.1:{args.bot_port}"
+        bot = nullcontext() if args.target else process(
+            "bot",
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.bot_port), "--log-level", "warning"],
+            bot_environment(args, stub_url),
+            log_dir,
+        )
+        with bot:
+            wait_until_up(f"{target}/health")
+            report = asyncio.run(run_load(target, stub_url, config))
+
+    print_report(report)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
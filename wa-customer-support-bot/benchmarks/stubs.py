@@ -0,0 +1,343 @@
+"""
+Local stand-ins for WATI, OpenAI and RecallrAI, served from one FastAPI app.
+
+Every upstream has its own latency distribution and error rate, so the bot can be load
+tested offline under realistic (or deliberately bad) upstream behaviour:
+
+    python -m benchmarks.stubs --port 9100 --openai-latency-ms 800 --recallrai-error-rate 0.02
+
+Point the bot at it with
+    WATI_BASE_URL=http://127.0.0.1:9100/wati
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+    RECALLRAI_BASE_URL=http://127.0.0.1:9100
+
+Replies sent through WATI are recorded and served at GET /_stub/replies so the load driver
+can match them with the webhooks it sent. The OpenAI stub imitates prompt caching, reporting
+`cached_tokens` for the longest previously seen prefix of whole messages (at least 1024
+tokens, in steps of 128, at ~4 characters per token). Profiles can be changed while a test runs, e.g. to
+simulate a RecallrAI outage and its recovery:
+
+    curl -X PATCH localhost:9100/_stub/profiles/recallrai -H 'content-type: application/json' -d '{"error_rate": 1}'
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import uvicorn
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+class UpstreamProfile(BaseModel):
+    """Latency is log-normal around `latency_ms` with spread `jitter`, `error_rate` is the share of failed calls"""
+    latency_ms: float = 50.0
+    jitter: float = 0.5
+    error_rate: float = 0.0
+    error_status: int = 500
+
+    async def delay(self) -> None:
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000 * random.lognormvariate(0, self.jitter))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+    async def simulate(self) -> Optional[JSONResponse]:
+        """Wait out the latency, then return an error response if this call should fail"""
+        await self.delay()
+        if self.fails():
+            return JSONResponse({"detail": "Injected stub error"}, status_code=self.error_status)
+        return None
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def wati_router(profile: UpstreamProfile, replies: List[Dict[str, Any]]) -> APIRouter:
+    router = APIRouter(prefix="/wati")
+
+    @router.post("/sendSessionMessage/{phone_number}")
+    async def send_session_message(phone_number: str, messageText: str, replyContextId: Optional[str] = None):
+        if (error := await profile.simulate()) is not None:
+            return error
+        message_id = uuid.uuid4().hex
+        replies.append({
+            "phone_number": phone_number,
+            "reply_context_id": replyContextId,
+            "text": messageText,
+            "at": time.time(),
+        })
+        return {
+            "ok": True,
+            "result": "success",
+            "message": {
+                "whatsappMessageId": f"wamid.{message_id}",
+                "localMessageId": message_id,
+                "text": messageText,
+                "type": "text",
+                "time": str(int(time.time())),
+                "status": 1,
+                "statusString": "SENT",
+                "isOwner": True,
+                "isUnread": False,
+                "ticketId": phone_number,
+                "replyContextId": replyContextId,
+                "sourceType": 0,
+                "isDeleted": False,
+                "isDelayed": False,
+                "id": message_id,
+                "tenantId": "stub",
+                "created": now_iso(),
+                "conversationId": phone_number,
+                "channelType": 0,
+            },
+        }
+
+    @router.get("/getMessages/{phone_number}")
+    async def get_messages(phone_number: str):
+        if (error := await profile.simulate()) is not None:
+            return error
+        items = [
+            {"eventType": "message", "owner": True, "text": reply["text"]}
+            for reply in reversed(replies)
+            if reply["phone_number"] == phone_number
+        ]
+        return {"result": "success", "messages": {"items": items}}
+
+    return router
+
+def cached_prefix_tokens(body: Dict[str, Any], seen: Dict[str, None], max_prefixes: int = 100_000) -> int:
+    """Roughly what OpenAI's prompt cache would serve for this request, remembering its prefixes for later ones"""
+    digest = hashlib.sha256(json.dumps(body.get("tools"), sort_keys=True).encode())
+    tokens = len(json.dumps(body.get("tools"))) // 4 if body.get("tools") else 0
+    cached = 0
+    for message in body["messages"]:
+        digest.update(json.dumps(message, sort_keys=True).encode())
+        tokens += len(str(message.get("content") or "")) // 4 + 4
+        key = digest.hexdigest()
+        if key in seen:
+            cached = tokens
+        seen[key] = None
+    while len(seen) > max_prefixes:
+        seen.pop(next(iter(seen)))
+    return cached // 128 * 128 if cached >= 1024 else 0
+
+def openai_router(profile: UpstreamProfile) -> APIRouter:
+    router = APIRouter(prefix="/v1")
+    prefixes: Dict[str, None] = {}
+
+    @router.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await profile.delay()
+        if profile.fails():
+            return JSONResponse(
+                {"error": {"message": "Injected stub error", "type": "server_error", "code": None}},
+                status_code=profile.error_status,
+                headers={"retry-after-ms": "200"} if profile.error_status == 429 else None,
+            )
+        prompt_tokens = sum(len(str(message.get("content") or "")) // 4 + 4 for message in body["messages"])
+        cached_tokens = cached_prefix_tokens(body, prefixes)
+        content = "Zo Zo! Thanks for reaching out, we're looking into it. Zo Zo Zo"
+        return JSONResponse(
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": prompt_tokens + len(content) // 4,
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                },
+            },
+            headers={
+                "x-ratelimit-limit-requests": "10000",
+                "x-ratelimit-remaining-requests": "9999",
+                "x-ratelimit-limit-tokens": "10000000",
+                "x-ratelimit-remaining-tokens": "9999000",
+            },
+        )
+
+    return router
+
+def recallrai_router(profile: UpstreamProfile) -> APIRouter:
+    """In-memory users, sessions and messages with the response shapes the RecallrAI SDK expects"""
+    router = APIRouter(prefix="/api/v1/users")
+    users: Dict[str, Dict[str, Any]] = {}
+    sessions: Dict[str, Dict[str, Any]] = {}
+
+    def not_found(what: str) -> JSONResponse:
+        return JSONResponse({"detail": f"{what} not found"}, status_code=404)
+
+    @router.post("")
+    async def create_user(request: Request):
+        body = await request.json()
+        if (error := await profile.simulate()) is not None:
+            return error
+        if body["user_id"] in users:
+            return JSONResponse({"detail": "User already exists"}, status_code=409)
+        users[body["user_id"]] = {
+            "user_id": body["user_id"],
+            "metadata": body.get("metadata", {}),
+            "created_at": now_iso(),
+            "last_active_at": now_iso(),
+            "sessions": [],
+        }
+        return JSONResponse({"user": {k: v for k, v in users[body["user_id"]].items() if k != "sessions"}}, status_code=201)
+
+    @router.get("/{user_id}")
+    async def get_user(user_id: str):
+        if (error := await profile.simulate()) is not None:
+            return error
+        if user_id not in users:
+            return not_found(f"User {user_id}")
+        return {"user": {k: v for k, v in users[user_id].items() if k != "sessions"}}
+
+    @router.post("/{user_id}/sessions")
+    async def create_session(user_id: str):
+        if (error := await profile.simulate()) is not None:
+            return error
+        if user_id not in users:
+            return not_found(f"User {user_id}")
+        session_id = str(uuid.uuid4())
+        sessions[session_id] = {"session_id": session_id, "status": "pending", "created_at": now_iso(), "messages": []}
+        users[user_id]["sessions"].insert(0, session_id)
+        return JSONResponse({"session_id": session_id}, status_code=201)
+
+    @router.get("/{user_id}/sessions")
+    async def list_sessions(user_id: str, offset: int = 0, limit: int = 10):
+        if (error := await profile.simulate()) is not None:
+            return error
+        if user_id not in users:
+            return not_found(f"User {user_id}")
+        ids = users[user_id]["sessions"]
+        return {
+            "sessions": [
+                {k: v for k, v in sessions[session_id].items() if k != "messages"}
+                for session_id in ids[offset:offset + limit]
+            ],
+            "total": len(ids),
+            "has_more": offset + limit < len(ids),
+        }
+
+    @router.get("/{user_id}/sessions/{session_id}/status")
+    async def session_status(user_id: str, session_id: str):
+        if (error := await profile.simulate()) is not None:
+            return error
+        if session_id not in sessions:
+            return not_found(f"Session {session_id}")
+        return {"status": sessions[session_id]["status"]}
+
+    @router.post("/{user_id}/sessions/{session_id}/add-message")
+    async def add_message(user_id: str, session_id: str, request: Request):
+        body = await request.json()
+        if (error := await profile.simulate()) is not None:
+            return error
+        if session_id not in sessions:
+            return not_found(f"Session {session_id}")
+        if sessions[session_id]["status"] != "pending":
+            return JSONResponse({"detail": "Session is not pending"}, status_code=400)
+        sessions[session_id]["messages"].append({"role": body["role"], "content": body["message"], "timestamp": now_iso()})
+        return {"success": True}
+
+    @router.get("/{user_id}/sessions/{session_id}/messages")
+    async def get_messages(user_id: str, session_id: str):
+        if (error := await profile.simulate()) is not None:
+            return error
+        if session_id not in sessions:
+            return not_found(f"Session {session_id}")
+        return {"messages": sessions[session_id]["messages"]}
+
+    @router.get("/{user_id}/sessions/{session_id}/context")
+    async def get_context(user_id: str, session_id: str):
+        if (error := await profile.simulate()) is not None:
+            return error
+        if session_id not in sessions:
+            return not_found(f"Session {session_id}")
+        # Users only have long-term memories once one of their sessions was processed
+        if not any(sessions[known]["status"] == "processed" for known in users[user_id]["sessions"] if known in sessions):
+            return {"memory_used": False, "context": "No memories about this user yet."}
+        return {"memory_used": True, "context": f"The customer ({user_id}) has stayed at Zostel Goa before and prefers dorm beds."}
+
+    @router.post("/{user_id}/sessions/{session_id}/process")
+    async def process_session(user_id: str, session_id: str):
+        if (error := await profile.simulate()) is not None:
+            return error
+        if session_id not in sessions:
+            return not_found(f"Session {session_id}")
+        sessions[session_id]["status"] = "processed"
+        return {"success": True}
+
+    return router
+
+def create_stub_app(wati: UpstreamProfile, openai: UpstreamProfile, recallrai: UpstreamProfile) -> FastAPI:
+    app = FastAPI(title="Upstream stubs")
+    replies: List[Dict[str, Any]] = []
+    app.include_router(wati_router(wati, replies))
+    app.include_router(openai_router(openai))
+    app.include_router(recallrai_router(recallrai))
+    profiles = {"wati": wati, "openai": openai, "recallrai": recallrai}
+
+    @app.get("/_stub/replies")
+    async def get_replies(since: int = 0):
+        return {"replies": replies[since:]}
+
+    @app.post("/_stub/reset")
+    async def reset():
+        replies.clear()
+        return {"ok": True}
+
+    @app.patch("/_stub/profiles/{name}")
+    async def update_profile(name: str, changes: Dict[str, float]):
+        if name not in profiles:
+            return JSONResponse({"detail": f"Unknown upstream {name}"}, status_code=404)
+        profile = profiles[name]
+        for field, value in changes.items():
+            if field in PROFILE_FIELDS:
+                setattr(profile, field, type(getattr(profile, field))(value))
+        return profile
+
+    return app
+
+PROFILE_FIELDS = ("latency_ms", "jitter", "error_rate", "error_status")
+
+def add_profile_arguments(parser: argparse.ArgumentParser, name: str, latency_ms: float, error_status: int = 500) -> None:
+    parser.add_argument(f"--{name}-latency-ms", type=float, default=latency_ms, help=f"median {name} latency")
+    parser.add_argument(f"--{name}-jitter", type=float, default=0.5, help=f"log-normal spread of {name} latency")
+    parser.add_argument(f"--{name}-error-rate", type=float, default=0.0, help=f"share of {name} calls that fail")
+    parser.add_argument(f"--{name}-error-status", type=int, default=error_status, help=f"HTTP status of failed {name} calls")
+
+def profile_from_arguments(args: argparse.Namespace, name: str) -> UpstreamProfile:
+    return UpstreamProfile(**{field: getattr(args, f"{name}_{field}") for field in PROFILE_FIELDS})
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for WATI, OpenAI and RecallrAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_profile_arguments(parser, "wati", 80)
+    add_profile_arguments(parser, "openai", 700, error_status=429)
+    add_profile_arguments(parser, "recallrai", 120)
+    return parser
+
+def main() -> None:
+    args = build_parser().parse_args()
+    app = create_stub_app(
+        wati=profile_from_arguments(args, "wati"),
+        openai=profile_from_arguments(args, "openai"),
+        recallrai=profile_from_arguments(args, "recallrai"),
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
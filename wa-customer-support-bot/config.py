@@ -1,18 +1,107 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 class Settings(BaseSettings):
     # OpenAI
     OPENAI_API_KEY: str
+    OPENAI_BASE_URL: Optional[str] = None
+    PROMPT_MAX_TOKENS: int = 8000
+    PROMPT_MAX_CONTEXT_TOKENS: int = 2000
+    PROMPT_SUMMARY_TOKENS: int = 200
+    # Pacing of OpenAI calls. Unset rate limits are learned from OpenAI's rate-limit headers.
+    LLM_INITIAL_CONCURRENCY: int = 8
+    LLM_MIN_CONCURRENCY: int = 1
+    LLM_MAX_CONCURRENCY: int = 64
+    LLM_REQUESTS_PER_MINUTE: Optional[float] = None
+    LLM_TOKENS_PER_MINUTE: Optional[float] = None
+    LLM_MAX_RETRIES: int = 4
+    LLM_BACKOFF_BASE: float = 0.5
+    LLM_BACKOFF_MAX: float = 20.0
     
     # RecallrAI
     RECALLRAI_API_KEY: str
     RECALLRAI_PROJECT_ID: str
+    RECALLRAI_BASE_URL: str = "https://api.recallrai.com"
+    # A call that hits RECALLRAI_CALL_TIMEOUT keeps its worker thread until the SDK's own RECALLRAI_TIMEOUT
+    RECALLRAI_TIMEOUT: int = 15
+    RECALLRAI_CALL_TIMEOUT: float = 5.0
+    RECALLRAI_MAX_WORKERS: int = 32
+    # Circuit breaker in front of RecallrAI. While it is open, turns are answered without
+    # memory and the writes they miss are replayed once RecallrAI is back.
+    MEMORY_BREAKER_WINDOW: int = 20
+    MEMORY_BREAKER_MIN_CALLS: int = 5
+    MEMORY_BREAKER_FAILURE_RATE: float = 0.5
+    MEMORY_BREAKER_SLOW_CALL_SECONDS: float = 3.0
+    MEMORY_BREAKER_OPEN_SECONDS: float = 15.0
+    MEMORY_BREAKER_HALF_OPEN_CALLS: int = 1
+    MEMORY_BACKLOG_MAX_CONVERSATIONS: int = 10_000
+    MEMORY_BACKLOG_MAX_WRITES: int = 200
+    MEMORY_REPLAY_INTERVAL: float = 10.0
+    SESSION_AUTO_PROCESS_MINUTES: int = 5
+    SESSION_CACHE_TTL: int = 240
+    SESSION_CACHE_MAX_ENTRIES: int = 100_000
+    CONVERSATION_BUFFER_MAX_SESSIONS: int = 10_000
+    CONVERSATION_RECONCILE_INTERVAL: int = 600
+    # Contexts are also dropped when a user is moved on to a new session because their last one was processed
+    CONTEXT_CACHE_TTL: int = 300
+    CONTEXT_CACHE_MAX_USERS: int = 10_000
+    # Reuse answers to repeated (FAQ-style) questions asked against the same memory context
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_TTL: int = 3600
+    ANSWER_CACHE_MAX_ENTRIES: int = 5000
+    # Jaccard similarity of character trigrams a question needs to reuse a cached answer
+    ANSWER_CACHE_THRESHOLD: float = 0.8
+    ANSWER_CACHE_MIN_CHARS: int = 10
     
     # WATI
     WATI_API_TOKEN: str
     WATI_BASE_URL: str
     ALLOWED_PHONE_NUMBERS: list[str] = []
+    WATI_HTTP2: bool = True
+    WATI_MAX_CONNECTIONS: int = 100
+    WATI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    WATI_KEEPALIVE_EXPIRY: float = 30.0
+    WATI_TIMEOUT: float = 10.0
+    WATI_CONNECT_TIMEOUT: float = 5.0
+    
+    # Deduplication of WATI webhook retries
+    IDEMPOTENCY_DB_PATH: Optional[str] = None
+    IDEMPOTENCY_MAX_ENTRIES: int = 100_000
+    IDEMPOTENCY_IN_FLIGHT_TTL: int = 300
+    IDEMPOTENCY_DONE_TTL: int = 7 * 24 * 3600
+    
+    # Outbox for replies, so a failed WATI send is retried instead of losing the reply
+    REPLY_OUTBOX_DB_PATH: str = "reply_outbox.db"
+    REPLY_OUTBOX_MAX_ATTEMPTS: int = 8
+    REPLY_OUTBOX_BACKOFF_BASE: float = 1.0
+    REPLY_OUTBOX_BACKOFF_MAX: float = 300.0
+    REPLY_OUTBOX_CONCURRENCY: int = 16
+    REPLY_OUTBOX_LEASE_SECONDS: float = 60.0
+    
+    # Background processing of accepted webhooks
+    WORKER_COUNT: int = 16
+    QUEUE_MAX_DEPTH: int = 1000
+    QUEUE_DRAIN_TIMEOUT: float = 30.0
+    MAX_CONCURRENT_CONVERSATIONS: int = 16
+    COALESCE_WINDOW_MS: int = 1500
+    COALESCE_MAX_WAIT_MS: int = 5000
+    # Messages accepted by the scheduler but not yet answered, in total and per phone number
+    SCHEDULER_MAX_BACKLOG: int = 1000
+    SCHEDULER_MAX_BACKLOG_PER_NUMBER: int = 50
+    # A failed turn is re-queued with backoff, WATI won't redeliver a message we already acknowledged
+    TURN_MAX_ATTEMPTS: int = 4
+    TURN_RETRY_BACKOFF_BASE: float = 2.0
+    TURN_RETRY_BACKOFF_MAX: float = 60.0
+    EVENT_LOOP_MONITOR_INTERVAL: float = 0.25
+    
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FILE: str = "app.log"
+    LOG_MAX_BYTES: int = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT: int = 5
+    LOG_JSON: bool = False
+    LOG_MAX_MESSAGE_CHARS: int = 2000
 
     
     class Config:
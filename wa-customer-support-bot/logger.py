@@ -1,74 +1,96 @@
 # Path: app/logger.py
 
 from functools import lru_cache
+import atexit
+import json
 import logging
-import logging.config
+import logging.handlers
+import queue
+from datetime import datetime, timezone
 from colorlog import ColoredFormatter
+from config import get_settings
+
+LOG_FORMAT = "%(asctime)s - %(filename)s - %(levelname)s - %(message)s [line: %(lineno)d]"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a background `QueueListener` instead of writing them on the calling thread.
+
+    `prepare` runs on the caller, so it only merges the message with its args and cuts it
+    down to `max_chars`. That keeps large payloads (webhook bodies, WATI histories) from
+    being copied into the queue and written out in full.
+    """
+
+    def __init__(self, log_queue: queue.SimpleQueue, max_chars: int):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        if self.max_chars and len(record.msg) > self.max_chars:
+            record.msg = f"{record.msg[:self.max_chars]}... [truncated {len(record.msg) - self.max_chars} chars]"
+            record.message = record.msg
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }, ensure_ascii=False)
 
 @lru_cache
 def get_logger():
     """Get a logger instance."""
+    settings = get_settings()
     logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
 
-    # Logging configuration
-    logging_config = {
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "default": {
-                "()": "colorlog.ColoredFormatter",
-                "format": "%(log_color)s%(asctime)s - %(filename)s - %(levelname)s - %(message)s [line: %(lineno)d]",
-                "datefmt": "%Y-%m-%d %H:%M:%S",
-                "log_colors": {
-                    "DEBUG": "cyan",
-                    "INFO": "green",
-                    "WARNING": "yellow",
-                    "ERROR": "red",
-                    "CRITICAL": "bold_red",
-                },
+    # Handlers that actually write, run by the listener thread
+    console_handler = logging.StreamHandler()
+    file_handler = logging.handlers.RotatingFileHandler(
+        settings.LOG_FILE,
+        maxBytes=settings.LOG_MAX_BYTES,
+        backupCount=settings.LOG_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    if settings.LOG_JSON:
+        console_handler.setFormatter(JsonFormatter())
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        console_handler.setFormatter(ColoredFormatter(
+            "%(log_color)s" + LOG_FORMAT,
+            datefmt=DATE_FORMAT,
+            log_colors={
+                "DEBUG": "cyan",
+                "INFO": "green",
+                "WARNING": "yellow",
+                "ERROR": "red",
+                "CRITICAL": "bold_red",
             },
-            "access": {
-                "()": "colorlog.ColoredFormatter",
-                "format": "%(log_color)s%(asctime)s - %(filename)s - %(levelname)s - %(message)s [line: %(lineno)d]",
-                "datefmt": "%Y-%m-%d %H:%M:%S",
-                "log_colors": {"INFO": "green", "WARNING": "yellow", "ERROR": "red"},
-            },
-            "file": {
-                "format": "%(asctime)s - %(filename)s - %(levelname)s - %(message)s [line: %(lineno)d]",
-                "datefmt": "%Y-%m-%d %H:%M:%S",
-            },
-        },
-        "handlers": {
-            "default": {
-                "formatter": "default",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
-            },
-            "access": {
-                "formatter": "access",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
-            },
-            "file": {
-                "formatter": "file",
-                "class": "logging.FileHandler",
-                "filename": "app.log",  # Change to your desired log file path
-                "mode": "a",
-                "encoding": "utf-8",
-            },
-        },
-        "loggers": {
-            "": {"handlers": ["default", "file"], "level": "DEBUG"},
-            "uvicorn.error": {
-                "handlers": ["default", "file"],
-                "level": "DEBUG",
-                "propagate": False,
-            },
-            "uvicorn.access": {"handlers": ["access", "file"], "level": "INFO", "propagate": False},
-        },
-    }
+        ))
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+
+    # Every logger only enqueues. dictConfig can't set up queue handlers before Python 3.12, so this is done by hand.
+    log_queue = queue.SimpleQueue()
+    queue_handler = TruncatingQueueHandler(log_queue, max_chars=settings.LOG_MAX_MESSAGE_CHARS)
+    listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
-    logging.config.dictConfig(logging_config)
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(settings.LOG_LEVEL)
+    for name in ("uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = [queue_handler]
+        uvicorn_logger.setLevel(settings.LOG_LEVEL)
+        uvicorn_logger.propagate = False
 
     return logger
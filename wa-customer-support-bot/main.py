@@ -1,134 +1,159 @@
+import asyncio
+import random
+import uuid
 import openai
 from config import get_settings
 from logger import get_logger
-from fastapi import FastAPI, HTTPException
-from models import WebhookData, WebhookResponse, WatiSendMessageRequest, WatiApiResponse, HealthResponse
-from typing import Optional, List, Dict
+from fastapi import FastAPI, HTTPException, Response
+from models import WebhookData, WebhookResponse, QueuedMessage, WatiSendMessageRequest, WatiApiResponse, HealthResponse
+from utils import AsyncMemoryClient, MemoryUnavailableError, WatiClient, IdempotencyStore, WorkQueue, KeyedScheduler, SessionCache, ContextCache, AnswerCache, ConversationStore, BackgroundTaskGroup, EventLoopMonitor, LLMGateway, WriteBacklog, ReplyOutbox, PromptTemplate, build_prompt, metrics
+from typing import Any, Callable, Optional, List, Dict, Tuple
+from contextlib import asynccontextmanager
 from recallrai import RecallrAI
-from recallrai.models import SessionStatus
-from recallrai.exceptions import UserNotFoundError
-import httpx
+from recallrai.exceptions import InvalidSessionStateError
+from recallrai.models import Context
 
 settings = get_settings()
 logger = get_logger()
-app = FastAPI(title="WhatsApp Customer Support Bot with WATI Integration", version="1.0.0")
 
 # Initialize clients
 rai_client = RecallrAI(
     api_key=settings.RECALLRAI_API_KEY,
     project_id=settings.RECALLRAI_PROJECT_ID,
-    timeout=60,
+    base_url=settings.RECALLRAI_BASE_URL,
+    timeout=settings.RECALLRAI_TIMEOUT,
 )
-oai_client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+# The RecallrAI SDK is synchronous, so all memory calls go through a thread pool to keep the event loop free
+memory = AsyncMemoryClient(
+    rai_client,
+    max_workers=settings.RECALLRAI_MAX_WORKERS,
+    call_timeout=settings.RECALLRAI_CALL_TIMEOUT,
+    breaker_window=settings.MEMORY_BREAKER_WINDOW,
+    breaker_minimum_calls=settings.MEMORY_BREAKER_MIN_CALLS,
+    breaker_failure_rate=settings.MEMORY_BREAKER_FAILURE_RATE,
+    breaker_slow_call_seconds=settings.MEMORY_BREAKER_SLOW_CALL_SECONDS,
+    breaker_open_seconds=settings.MEMORY_BREAKER_OPEN_SECONDS,
+    breaker_half_open_calls=settings.MEMORY_BREAKER_HALF_OPEN_CALLS,
+)
+# waId -> memory writes missed while RecallrAI was unavailable, replayed in order once it recovers
+missed_writes = WriteBacklog(
+    max_keys=settings.MEMORY_BACKLOG_MAX_CONVERSATIONS,
+    max_per_key=settings.MEMORY_BACKLOG_MAX_WRITES,
+)
+# waId -> (user, active session), so the hot path skips get_user/list_sessions/get_session
+session_cache = SessionCache(
+    auto_process_after_minutes=settings.SESSION_AUTO_PROCESS_MINUTES,
+    max_entries=settings.SESSION_CACHE_MAX_ENTRIES,
+    ttl=settings.SESSION_CACHE_TTL,
+)
+# waId -> RecallrAI context of the active session, so most turns skip the get_context round-trips
+context_cache = ContextCache(ttl=settings.CONTEXT_CACHE_TTL, max_users=settings.CONTEXT_CACHE_MAX_USERS)
+# Answers to repeated questions, reused when the memory context is the same
+answer_cache = AnswerCache(
+    ttl=settings.ANSWER_CACHE_TTL,
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+    min_chars=settings.ANSWER_CACHE_MIN_CHARS,
+) if settings.ANSWER_CACHE_ENABLED else None
+# session_id -> local copy of the session's messages, so we don't re-download the history every turn
+conversations = ConversationStore(
+    max_sessions=settings.CONVERSATION_BUFFER_MAX_SESSIONS,
+    reconcile_interval=settings.CONVERSATION_RECONCILE_INTERVAL,
+)
+# Post-reply bookkeeping that shouldn't hold up the customer
+background = BackgroundTaskGroup("post-reply")
+oai_client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+# All completions go through the gateway, so a webhook spike queues here instead of turning into a wave of 429s
+llm = LLMGateway(
+    oai_client,
+    initial_concurrency=settings.LLM_INITIAL_CONCURRENCY,
+    min_concurrency=settings.LLM_MIN_CONCURRENCY,
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+    max_retries=settings.LLM_MAX_RETRIES,
+    backoff_base=settings.LLM_BACKOFF_BASE,
+    backoff_max=settings.LLM_BACKOFF_MAX,
+)
+# Reports how long the event loop is blocked, see /health
+loop_monitor = EventLoopMonitor(interval=settings.EVENT_LOOP_MONITOR_INTERVAL)
 
-async def send_whatsapp_message(data: WatiSendMessageRequest) -> WatiApiResponse:
-    """Send message via WATI API"""
-    url = f"{settings.WATI_BASE_URL}/sendSessionMessage/{data.phone_number}"
-    headers = {
-        "Authorization": settings.WATI_API_TOKEN,
-        "Content-Type": "application/json"
-    }
-    params = {
-        "messageText": data.message_text,
-    }
-    if data.reply_context_id:
-        params["replyContextId"] = data.reply_context_id
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, params=params, headers=headers)
-        logger.info(f"Response from WATI: {response.status_code} - {response.text}")
-        
-        if response.status_code == 200:
-            return WatiApiResponse(**response.json())
-        else:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled WATI client for the whole process, so connections are reused across webhooks
+    app.state.wati = WatiClient(
+        base_url=settings.WATI_BASE_URL,
+        api_token=settings.WATI_API_TOKEN,
+        http2=settings.WATI_HTTP2,
+        max_connections=settings.WATI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.WATI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.WATI_KEEPALIVE_EXPIRY,
+        timeout=settings.WATI_TIMEOUT,
+        connect_timeout=settings.WATI_CONNECT_TIMEOUT,
+    )
+    # Replies are persisted before they are sent and delivered from here, with retries
+    app.state.replies = ReplyOutbox(
+        send_whatsapp_message,
+        db_path=settings.REPLY_OUTBOX_DB_PATH,
+        max_attempts=settings.REPLY_OUTBOX_MAX_ATTEMPTS,
+        backoff_base=settings.REPLY_OUTBOX_BACKOFF_BASE,
+        backoff_max=settings.REPLY_OUTBOX_BACKOFF_MAX,
+        max_concurrency=settings.REPLY_OUTBOX_CONCURRENCY,
+        lease_seconds=settings.REPLY_OUTBOX_LEASE_SECONDS,
+    )
+    app.state.idempotency = IdempotencyStore(
+        db_path=settings.IDEMPOTENCY_DB_PATH,
+        max_entries=settings.IDEMPOTENCY_MAX_ENTRIES,
+        in_flight_ttl=settings.IDEMPOTENCY_IN_FLIGHT_TTL,
+        done_ttl=settings.IDEMPOTENCY_DONE_TTL,
+    )
+    # Messages from the same phone number run one at a time and in order, different numbers run in parallel.
+    # Rapid-fire messages from one number are merged into a single turn.
+    app.state.scheduler = KeyedScheduler(
+        handle_messages,
+        max_concurrency=settings.MAX_CONCURRENT_CONVERSATIONS,
+        coalesce_window=settings.COALESCE_WINDOW_MS / 1000,
+        coalesce_max_wait=settings.COALESCE_MAX_WAIT_MS / 1000,
+        max_backlog=settings.SCHEDULER_MAX_BACKLOG,
+        max_backlog_per_key=settings.SCHEDULER_MAX_BACKLOG_PER_NUMBER,
+    )
+    # Webhooks only enqueue work; these workers hand it to the scheduler, which returns right away unless its backlog is full
+    app.state.queue = WorkQueue(
+        lambda job: app.state.scheduler.run(job.phone_number, job),
+        workers=settings.WORKER_COUNT,
+        max_depth=settings.QUEUE_MAX_DEPTH,
+        name="message-queue",
+    )
+    app.state.queue.start()
+    app.state.replies.start()
+    app.state.replayer = asyncio.create_task(replay_loop())
+    loop_monitor.start()
+    # Read at scrape time, so these cost nothing on the hot path
+    metrics.QUEUE_DEPTH.set_function(lambda: app.state.queue.stats()["depth"])
+    metrics.EVENT_LOOP_LAG.set_function(lambda: loop_monitor.stats()["lag_ms"] / 1000)
+    metrics.MEMORY_BACKLOG.set_function(lambda: len(missed_writes))
+    yield
+    await loop_monitor.stop()
+    await app.state.queue.stop(drain_timeout=settings.QUEUE_DRAIN_TIMEOUT)
+    await app.state.scheduler.stop(drain_timeout=settings.QUEUE_DRAIN_TIMEOUT)
+    await background.drain(timeout=settings.QUEUE_DRAIN_TIMEOUT)
+    app.state.replayer.cancel()
+    if len(missed_writes):
+        logger.warning(f"Shutting down with {len(missed_writes)} memory writes that were never replayed to RecallrAI")
+    # Replies still pending stay in the outbox and are sent after the restart
+    await app.state.replies.stop(drain_timeout=settings.QUEUE_DRAIN_TIMEOUT)
+    await app.state.wati.aclose()
+    app.state.replies.close()
+    app.state.idempotency.close()
+    memory.close()
 
-async def get_all_messages(phone_number: str) -> List[Dict[str, str]]:
-    """Get all messages for a given phone number and format them for LLM input"""
-    url = f"{settings.WATI_BASE_URL}/getMessages/{phone_number}"
-    headers = {
-        "Authorization": settings.WATI_API_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
-        logger.info(f"Response from WATI: {response.status_code} - {response.text}")
-        
-        if response.status_code == 200:
-            # Parse the response
-            data = response.json()
-            messages = data.get('messages', {}).get('items', [])
-            
-            # Filter for actual messages and convert to role-content pairs
-            formatted_messages = []
-            for msg in messages:
-                # Skip non-message events or messages without text
-                if msg.get('eventType') != 'message' or not msg.get('text'):
-                    continue
-                
-                # Determine role based on owner field
-                # owner=True means the message is from the assistant
-                # owner=False means the message is from the user
-                role = "assistant" if msg.get('owner', False) else "user"
-                
-                # Add to formatted messages
-                formatted_messages.append({
-                    "role": role,
-                    "content": msg.get('text')
-                })
-            
-            # Reverse to get chronological order (oldest first)
-            formatted_messages.reverse()
-            
-            return formatted_messages
-        else:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
+app = FastAPI(title="WhatsApp Customer Support Bot with WATI Integration", version="1.0.0", lifespan=lifespan)
 
-async def process_user_message(phone_number: str, message_text: str, reply_context_id: Optional[str] = None) -> str:
-    """Process incoming WhatsApp message"""
-    user_id = f"whatsapp_{phone_number}_prod"
-    
-    # Get or create user
-    try:
-        user = rai_client.get_user(user_id)
-    except UserNotFoundError:
-        user = rai_client.create_user(user_id)
-    
-    # Get the most recent session and check if it's still unprocessed
-    session = user.list_sessions(offset=0, limit=1).sessions
-    if session == []:
-        session = user.create_session(auto_process_after_minutes=5)
-    else:
-        session = session[0]
-        if session.status == SessionStatus.PENDING:
-            session = user.get_session(session.session_id)
-        else:
-            session = user.create_session(auto_process_after_minutes=5)
-    
-    # Add user message to Recallr AI
-    session.add_user_message(message_text)
-    
-    # Recallr AI Approach: Get previous messages in the unprocessed session (if any)
-    previous_messages = []
-    for message in session.get_messages():
-        previous_messages.append({
-            "role": message.role,
-            "content": message.content,
-        })
-    
-    # Direct Approach: Get all messages from WATI for the phone number
-    # previous_messages = get_all_messages(phone_number)
-    
-    # Get context from RecallrAI
-    context = session.get_context()
-    
-    # Create system prompt with context
-    system_prompt = f"""You are Zostel's Customer Support Assistant, known as a Zobu, equipped with advanced AI and full access to a comprehensive memory database for detailed historical context and customer profiles.
-You have access to a long term memory system which helps you recall past interactions and customer preferences.
-
-MEMORIES ABOUT THE USER:
-{context.context}
+# Static instructions first and the customer's memories after them, so every request starts with the same
+# prefix and OpenAI's prompt caching can reuse it. Nothing per-customer belongs in `instructions`.
+SYSTEM_PROMPT = PromptTemplate(
+    instructions="""You are Zostel's Customer Support Assistant, known as a Zobu, equipped with advanced AI and full access to a comprehensive memory database for detailed historical context and customer profiles.
+You have access to a long term memory system which helps you recall past interactions and customer preferences. What it remembers about the customer is given after these instructions.
 
 Your primary objective is to resolve customer queries swiftly, accurately, and empathetically by following the Zobu Protocol:
     1.	Greeting and Acknowledgement:
@@ -159,129 +184,448 @@ Your primary objective is to resolve customer queries swiftly, accurately, and e
         •	Regularly update yourself with latest protocols, policies, and case-specific learnings available in resources like Ezee tutorials and internal documentation.
 
 Ensure all interactions reflect Zostel's vibrant, community-driven ethos, and strive for excellence in customer satisfaction.
-Only give short and concise responses, avoiding unnecessary details."""
+Only give short and concise responses, avoiding unnecessary details.""",
+    memory_template="MEMORIES ABOUT THE USER:\n{context}",
+)
+
+# Stands in for the memories while RecallrAI is unavailable, so the model doesn't pretend to remember
+MEMORY_UNAVAILABLE_CONTEXT = "(Memory is temporarily unavailable. Only rely on what the customer has said in this conversation.)"
+
+async def send_whatsapp_message(data: WatiSendMessageRequest) -> WatiApiResponse:
+    """Send message via WATI API"""
+    return await app.state.wati.send_session_message(data)
+
+async def get_all_messages(phone_number: str) -> List[Dict[str, str]]:
+    """Get all messages for a given phone number and format them for LLM input"""
+    messages = await app.state.wati.get_messages(phone_number)
+    
+    # Filter for actual messages and convert to role-content pairs
+    formatted_messages = []
+    for msg in messages:
+        # Skip non-message events or messages without text
+        if msg.get('eventType') != 'message' or not msg.get('text'):
+            continue
+        
+        # Determine role based on owner field
+        # owner=True means the message is from the assistant
+        # owner=False means the message is from the user
+        role = "assistant" if msg.get('owner', False) else "user"
+        
+        # Add to formatted messages
+        formatted_messages.append({
+            "role": role,
+            "content": msg.get('text')
+        })
+    
+    # Reverse to get chronological order (oldest first)
+    formatted_messages.reverse()
+    
+    return formatted_messages
+
+async def resolve_session(phone_number: str):
+    """Stage: find the user and their active session, from the cache when possible"""
+    cached = session_cache.get(phone_number)
+    if cached is not None:
+        return cached
+    
+    # Get or create user
+    user = await memory.get_or_create_user(f"whatsapp_{phone_number}_prod")
+    
+    # Get the most recent session if it's still unprocessed, otherwise start a new one
+    session = await memory.get_active_session(user, auto_process_after_minutes=settings.SESSION_AUTO_PROCESS_MINUTES)
+    return user, session
+
+async def start_new_session(phone_number: str, user):
+    """The cached session got processed, so its contents are now part of the user's memory. Start a fresh one."""
+    session_cache.invalidate(phone_number)
+    context_cache.memory_changed(phone_number)
+    return await memory.get_active_session(user, auto_process_after_minutes=settings.SESSION_AUTO_PROCESS_MINUTES)
+
+def history_key(phone_number: str, session) -> str:
+    """Local history buffer of the session, or of the phone number while no session could be resolved"""
+    return str(session.session_id) if session is not None else f"phone:{phone_number}"
+
+async def add_to_session(phone_number: str, user, session, role: str, content: str):
+    """Add one message to the session, moving on to a fresh session if the cached one was processed meanwhile. Returns the session written to."""
+    try:
+        await memory.add_message(session, role, content)
+        return session
+    except InvalidSessionStateError:
+        logger.info(f"Session {session.session_id} for {phone_number} is no longer pending, starting a new one")
+        session = await start_new_session(phone_number, user)
+        await memory.add_message(session, role, content)
+        return session
+
+async def replay_missed_writes(phone_number: str) -> None:
+    """Add the messages that were missed while RecallrAI was unavailable, oldest first, stopping at the first one that still fails"""
+    async with missed_writes.lock(phone_number):
+        pending = missed_writes.peek(phone_number)
+        if not pending:
+            return
+        try:
+            user, session = await resolve_session(phone_number)
+            for seq, (role, content) in pending:
+                session = await add_to_session(phone_number, user, session, role, content)
+                missed_writes.ack(phone_number, seq)
+        except MemoryUnavailableError:
+            return
+        session_cache.touch(phone_number, (user, session))
+    logger.info(f"Replayed {len(pending)} missed memory writes for {phone_number}")
+
+async def replay_loop() -> None:
+    """Replay missed writes of conversations that went quiet, whose next turn won't do it for them"""
+    while True:
+        await asyncio.sleep(settings.MEMORY_REPLAY_INTERVAL)
+        for phone_number in missed_writes.keys():
+            try:
+                await replay_missed_writes(phone_number)
+            except Exception as e:
+                logger.error(f"Replaying memory writes for {phone_number} failed: {e}")
+                continue
+            if phone_number in missed_writes:
+                # Still unavailable, try again next round
+                break
+
+async def write_to_memory(phone_number: str, user, session, writes: List[Tuple[str, str]]):
+    """
+    Add (role, content) messages to the phone number's session in order. Whatever can't be
+    written because RecallrAI is unavailable, or would overtake writes that are still
+    waiting for replay, is queued in `missed_writes`. Returns the session written to and
+    how many of the messages were written.
+    """
+    if phone_number in missed_writes:
+        await replay_missed_writes(phone_number)
+    if session is None or phone_number in missed_writes:
+        missed_writes.add(phone_number, writes)
+        return session, 0
+    for written, (role, content) in enumerate(writes):
+        try:
+            session = await add_to_session(phone_number, user, session, role, content)
+        except MemoryUnavailableError:
+            logger.warning(f"RecallrAI unavailable, queueing {len(writes) - written} memory writes for {phone_number}")
+            missed_writes.add(phone_number, writes[written:])
+            return session, written
+    return session, len(writes)
+
+async def record_user_messages(phone_number: str, user, session, message_texts: List[str]):
+    """
+    Stage: add the burst to Recallr AI and to the local history buffer. Returns the session it landed in and its history.
+    While RecallrAI is unavailable the burst is queued for replay and the history is whatever the local buffer has.
+    """
+    # Earlier background writes for this conversation must land first to keep the session in order
+    await background.wait(phone_number)
+    
+    # Add every user message of the burst to Recallr AI, in order
+    session, written = await write_to_memory(phone_number, user, session, [("user", text) for text in message_texts]) if message_texts else (session, 0)
+    if written:
+        session_cache.touch(phone_number, (user, session))
+    
+    # Recallr AI Approach: Get previous messages in the unprocessed session (if any).
+    # They come from the local buffer, which is only seeded from RecallrAI on a miss.
+    key = history_key(phone_number, session)
+    previous_messages = conversations.get(key)
+    if previous_messages is None:
+        try:
+            stored = await memory.get_messages(session) if session is not None else []
+            # RecallrAI already has the messages we just wrote, only the queued ones are missing
+            unseen = message_texts[written:]
+        except MemoryUnavailableError:
+            stored, unseen = [], message_texts
+        previous_messages = conversations.seed(key, stored)
+    else:
+        unseen = message_texts
+    for message_text in unseen:
+        conversations.append(key, "user", message_text)
+    
+    # Direct Approach: Get all messages from WATI for the phone number
+    # previous_messages = get_all_messages(phone_number)
+    return session, previous_messages
+
+async def fetch_context(phone_number: str, session, force_refresh: bool = False) -> Optional[Context]:
+    """Stage: what RecallrAI remembers about the user, from the context cache unless `force_refresh`. None while RecallrAI is unavailable."""
+    if session is None:
+        return None
+    if not force_refresh:
+        cached = context_cache.get(phone_number, session.session_id)
+        if cached is not None:
+            metrics.CONTEXT_CACHE.labels("hit").inc()
+            return cached
+    metrics.CONTEXT_CACHE.labels("miss").inc()
+    generation = context_cache.generation(phone_number)
+    try:
+        context = await memory.get_context(session)
+    except MemoryUnavailableError:
+        return None
+    context_cache.set(phone_number, session.session_id, context, generation)
+    return context
+
+async def record_assistant_message(phone_number: str, user, session, assistant_message: str) -> None:
+    """Stage (background): add the assistant reply to Recallr AI"""
+    session, written = await write_to_memory(phone_number, user, session, [("assistant", assistant_message)])
+    if written:
+        session_cache.touch(phone_number, (user, session))
+
+async def generate_answer(phone_number: str, context: str, previous_messages: List[Dict[str, Any]]) -> str:
+    """Stage: build the prompt for a turn and run the completion"""
+    # Create system prompt with context, fitting context and history into the token budget.
+    # Tokenizing a long context or history can take hundreds of ms, so keep it off the event loop.
+    with metrics.span("build_prompt"):
+        prompt = await asyncio.to_thread(
+            build_prompt,
+            SYSTEM_PROMPT,
+            context,
+            list(previous_messages),
+            max_tokens=settings.PROMPT_MAX_TOKENS,
+            max_context_tokens=settings.PROMPT_MAX_CONTEXT_TOKENS,
+            summary_tokens=settings.PROMPT_SUMMARY_TOKENS,
+        )
+    if prompt.trimmed_tokens:
+        logger.info(f"Prompt for {phone_number} trimmed by {prompt.trimmed_tokens} tokens ({prompt.dropped_messages} messages condensed), {prompt.prompt_tokens} tokens left")
     
     # Get LLM response
-    response = await oai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            *previous_messages,
-        ],
-        temperature=0.3,
-        max_tokens=500
-    )
+    with metrics.span("completion"):
+        response = await llm.create(
+            estimated_tokens=prompt.prompt_tokens + 500,
+            model="gpt-4o-mini",
+            messages=prompt.messages,
+            temperature=0.3,
+            max_tokens=500
+        )
+    
+    return response.choices[0].message.content
+
+async def process_user_message(
+    phone_number: str,
+    message_texts: List[str],
+    reply_context_id: Optional[str] = None,
+    reply_key: Optional[str] = None,
+    unrecorded_texts: Optional[List[str]] = None,
+    on_recorded: Optional[Callable[[], None]] = None,
+) -> str:
+    """
+    Process a burst of incoming WhatsApp messages as a single assistant turn
+
+    Stages:
+        resolve_session -> (record_user_messages || get_context) -> answer cache | completion -> enqueue reply
+                                                                                             \-> record_assistant_message (background)
     
-    assistant_message = response.choices[0].message.content
+    The reply is written to the outbox and sent from there, keyed by `reply_key` (the message
+    it answers), so a WATI failure is retried without generating the reply again.
     
-    # Add assistant response to RecallrAI
-    session.add_assistant_message(assistant_message)
+    If RecallrAI is unavailable the turn still gets answered, without memories and from the
+    local history buffer, and the writes it misses are replayed later.
     
-    # Send response via WhatsApp
+    Only `unrecorded_texts` (by default all of `message_texts`) are added to RecallrAI and the
+    history buffer, so a retried turn doesn't add its messages twice. `on_recorded` is called
+    once they have been.
+    """
+    with metrics.span("resolve_session"):
+        try:
+            user, session = await resolve_session(phone_number)
+        except MemoryUnavailableError:
+            user, session = None, None
+    
+    # Recording the burst and fetching context from RecallrAI don't depend on each other.
+    # Both are awaited before any error propagates, so `on_recorded` is never missed by a retry.
+    recorded, memory_context = await asyncio.gather(
+        metrics.timed("record_user_messages", record_user_messages(phone_number, user, session, message_texts if unrecorded_texts is None else unrecorded_texts)),
+        metrics.timed("get_context", fetch_context(phone_number, session)),
+        return_exceptions=True,
+    )
+    if isinstance(recorded, BaseException):
+        raise recorded
+    if on_recorded is not None:
+        on_recorded()
+    if isinstance(memory_context, BaseException):
+        raise memory_context
+    recorded_session, previous_messages = recorded
+    if recorded_session is not session:
+        # The burst moved to a new session, so the context has to come from that one
+        session = recorded_session
+        with metrics.span("get_context"):
+            memory_context = await fetch_context(phone_number, session)
+    if memory_context is None:
+        logger.warning(f"RecallrAI unavailable, answering {phone_number} without memory")
+        metrics.DEGRADED_TURNS.inc()
+        context = MEMORY_UNAVAILABLE_CONTEXT
+    else:
+        context = memory_context.context
+    
+    # Only the opening turn of a session with working memory goes through the answer cache: the answer to a
+    # later turn depends on the conversation so far. Answers that used the customer's memories stay theirs.
+    question = "\n".join(message_texts)
+    use_answer_cache = answer_cache is not None and memory_context is not None and len(previous_messages) <= len(message_texts)
+    answer_owner = phone_number if memory_context is not None and memory_context.memory_used else None
+    cached = answer_cache.get(question, context, answer_owner) if use_answer_cache else None
+    if cached is not None:
+        metrics.ANSWER_CACHE.labels("hit").inc()
+        logger.info(f"Reusing a cached answer for {phone_number} (similarity {cached.similarity})")
+        assistant_message = cached.answer
+    else:
+        assistant_message = await generate_answer(phone_number, context, previous_messages)
+        if use_answer_cache:
+            metrics.ANSWER_CACHE.labels("miss").inc()
+            answer_cache.set(question, context, assistant_message, answer_owner)
+    
+    # Hand the response to the outbox, which sends it via WhatsApp. It goes into the history only once
+    # it's there, so a turn retried after a failed enqueue doesn't leave an answer that was never sent.
     logger.info(f"Assistant [{phone_number}]: {assistant_message}")
-    await send_whatsapp_message(WatiSendMessageRequest(
-        phone_number=phone_number,
-        message_text=assistant_message,
-        reply_context_id=reply_context_id
-    ))
+    with metrics.span("enqueue_reply"):
+        await app.state.replies.enqueue(reply_key or f"{phone_number}:{uuid.uuid4().hex}", WatiSendMessageRequest(
+            phone_number=phone_number,
+            message_text=assistant_message,
+            reply_context_id=reply_context_id
+        ))
+    conversations.append(history_key(phone_number, session), "assistant", assistant_message)
+    
+    # Add assistant response to RecallrAI off the critical path, the customer shouldn't wait on a memory write.
+    # Cached answers are recorded too, so the session's memory matches what the customer was told.
+    background.spawn(
+        record_assistant_message(phone_number, user, session, assistant_message),
+        description=f"Adding assistant message for {phone_number}",
+        key=phone_number,
+    )
     
     return assistant_message
 
-async def check_if_message_processed(phone_number: str, message_id: str) -> bool:
-    """
-    Check if we've already processed and replied to this message
+async def handle_messages(jobs: List[QueuedMessage]) -> None:
+    """Run the pipeline for a burst of queued messages from one phone number and settle their idempotency claims"""
+    idempotency: IdempotencyStore = app.state.idempotency
+    unrecorded = [job for job in jobs if not job.recorded]
     
-    Args:
-        phone_number: The user's phone number
-        message_id: The WhatsApp message ID to check
-        
-    Returns:
-        bool: True if the message has already been processed, False otherwise
-    """
-    url = f"{settings.WATI_BASE_URL}/getMessages/{phone_number}"
-    headers = {
-        "Authorization": settings.WATI_API_TOKEN,
-        "Content-Type": "application/json"
-    }
+    def mark_recorded() -> None:
+        for job in unrecorded:
+            job.recorded = True
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            messages: List[Dict] = data.get('messages', {}).get('items', [])
-            
-            # Theese messages are in reverse chronological order, so we need to check from the oldest to the newest
-            # Reverse the messages to check from oldest to newest
-            messages.reverse()
-            
-            # Look for the user's message with the given ID
-            user_message_found = False
-            for msg in messages:
-                if msg.get('id') == message_id:
-                    user_message_found = True
-                    logger.info(f"Found user message {message_id} from {phone_number}")
-                
-                # If we found the user message, check if there's an assistant message right after it
-                # This indicates we've already processed this message
-                if user_message_found and msg.get('owner', False) == True:
-                    logger.info(f"Message {message_id} has already been processed")
-                    return True
-            
-            return False
-        else:
-            # In case of error, proceed with processing to avoid missing messages
-            logger.warning(f"Error checking message status: {response.status_code}")
-            return False
+    try:
+        # Reply in the context of the latest message of the burst
+        with metrics.TURNS_IN_FLIGHT.track_inprogress(), metrics.span("turn"):
+            await process_user_message(
+                jobs[0].phone_number,
+                [job.message_text for job in jobs],
+                jobs[-1].reply_context_id,
+                jobs[-1].message_id,
+                unrecorded_texts=[job.message_text for job in unrecorded],
+                on_recorded=mark_recorded,
+            )
+    except Exception as e:
+        # The webhook was acknowledged long ago, so WATI won't deliver these again: retry them here.
+        # The claims stay held meanwhile, so a stray redelivery is still dropped, and messages that were
+        # already added to the session are not added again.
+        attempt = max(job.attempts for job in jobs) + 1
+        if attempt < settings.TURN_MAX_ATTEMPTS:
+            delay = random.uniform(0, min(settings.TURN_RETRY_BACKOFF_MAX, settings.TURN_RETRY_BACKOFF_BASE * 2 ** (attempt - 1)))
+            logger.warning(f"Turn for {jobs[0].phone_number} failed (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+            metrics.TURNS.labels("retried").inc()
+            background.spawn(
+                requeue_messages([job.model_copy(update={"attempts": attempt}) for job in jobs], delay),
+                f"retry turn for {jobs[0].phone_number}",
+            )
+            return
+        metrics.TURNS.labels("failed").inc()
+        logger.error(f"Giving up on {len(jobs)} message(s) from {jobs[0].phone_number} after {attempt} attempts: {[job.message_id for job in jobs]}")
+        for job in jobs:
+            await idempotency.release(job.message_id)
+        raise
+    metrics.TURNS.labels("replied").inc()
+    for job in jobs:
+        await idempotency.complete(job.message_id)
+    if len(jobs) > 1:
+        logger.info(f"Coalesced {len(jobs)} messages from {jobs[0].phone_number} into one turn")
+
+async def requeue_messages(jobs: List[QueuedMessage], delay: float) -> None:
+    await asyncio.sleep(delay)
+    for job in jobs:
+        await app.state.scheduler.run(job.phone_number, job)
 
 @app.post("/webhook", response_model=WebhookResponse)
 async def wati_webhook(data: WebhookData) -> WebhookResponse:
     """Webhook to receive WATI messages"""
-    try:
-        # Check if it's an incoming message (not from us)
-        if data.eventType == 'message' and data.owner == False:
-            phone_number = data.waId
-            # Ignore messages from phone numbers not in the allowed list
-            if phone_number not in settings.ALLOWED_PHONE_NUMBERS:
-                logger.info(f"Ignoring message from phone number: {phone_number}")
-                return WebhookResponse(status="ignored", reason="phone number not allowed")
-            
-            # BUG: WATI has a bug that if a webhook delivery fails, it retries indefinitely.
-            # This can lead to duplicate processing of the same message.
-            # To mitigate this, we get all the messages of the user and check if we have sent a reply to that message, using whatsappMessageId.
-            message_id = data.id
-            already_processed = await check_if_message_processed(phone_number, message_id)
-            if already_processed:
-                logger.info(f"Skipping already processed message {message_id} from {phone_number}")
-                return WebhookResponse(status="ignored", reason="message already processed")
-            
-            logger.info(f"Received webhook data: {data.model_dump_json()}")
+    with metrics.span("webhook"):
+        try:
+            # Check if it's an incoming message (not from us)
+            if data.eventType == 'message' and data.owner == False:
+                phone_number = data.waId
+                # Ignore messages from phone numbers not in the allowed list
+                if phone_number not in settings.ALLOWED_PHONE_NUMBERS:
+                    logger.info(f"Ignoring message from phone number: {phone_number}")
+                    metrics.WEBHOOKS.labels("not_allowed").inc()
+                    return WebhookResponse(status="ignored", reason="phone number not allowed")
+                
+                # BUG: WATI has a bug that if a webhook delivery fails, it retries indefinitely.
+                # This can lead to duplicate processing of the same message.
+                # To mitigate this, we claim the message id in a local idempotency store before doing any work.
+                # A retry that arrives while the message is in flight or after it was answered is dropped.
+                idempotency: IdempotencyStore = app.state.idempotency
+                message_id = data.id
+                with metrics.span("dedup"):
+                    claimed = await idempotency.claim(message_id)
+                if not claimed:
+                    logger.info(f"Skipping already processed message {message_id} from {phone_number}")
+                    metrics.WEBHOOKS.labels("duplicate").inc()
+                    return WebhookResponse(status="ignored", reason="message already processed")
+                
+                logger.info(f"Received webhook data: {data.model_dump_json()}")
 
-            # Extract message text based on message type
-            message_text = None
-            message_type = data.type
+                # Extract message text based on message type
+                message_text = None
+                message_type = data.type
+                
+                if message_type == 'text':
+                    message_text = data.text
+                elif message_type == 'button' and data.buttonReply:
+                    message_text = data.buttonReply.get('text')
+                elif message_type == 'list' and data.listReply:
+                    message_text = data.listReply.get('title')
+                
+                if phone_number and message_text:
+                    # Hand the message to the background workers and acknowledge right away,
+                    # so WATI never times out waiting on the LLM and retries the delivery
+                    with metrics.span("enqueue"):
+                        queued = app.state.queue.submit(QueuedMessage(
+                            message_id=message_id,
+                            phone_number=phone_number,
+                            message_text=message_text,
+                            reply_context_id=data.whatsappMessageId,
+                        ))
+                    if not queued:
+                        # Fail the delivery so WATI retries it once the backlog has cleared
+                        await idempotency.release(message_id)
+                        metrics.WEBHOOKS.labels("queue_full").inc()
+                        raise HTTPException(status_code=503, detail="queue full")
+                    metrics.WEBHOOKS.labels("queued").inc()
+                    return WebhookResponse(status="queued")
+                else:
+                    logger.warning(f"Missing phone_number ({phone_number}) or message_text ({message_text})")
+                    await idempotency.complete(message_id)
+                    metrics.WEBHOOKS.labels("missing_fields").inc()
+                    return WebhookResponse(status="ignored", reason="missing required fields")
             
-            if message_type == 'text':
-                message_text = data.text
-            elif message_type == 'button' and data.buttonReply:
-                message_text = data.buttonReply.get('text')
-            elif message_type == 'list' and data.listReply:
-                message_text = data.listReply.get('title')
+            metrics.WEBHOOKS.labels("not_incoming").inc()
+            return WebhookResponse(status="ignored", reason="not an incoming message")
             
-            if phone_number and message_text:
-                # Process the message
-                response = await process_user_message(phone_number, message_text, data.whatsappMessageId)
-                return WebhookResponse(status="success", reason=f"Assistant [{phone_number}]: {response}")
-            else:
-                logger.warning(f"Missing phone_number ({phone_number}) or message_text ({message_text})")
-                return WebhookResponse(status="ignored", reason="missing required fields")
-        
-        return WebhookResponse(status="ignored", reason="not an incoming message")
-        
-    except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
-        return WebhookResponse(status="error", reason=str(e))
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing webhook: {e}")
+            metrics.WEBHOOKS.labels("error").inc()
+            return WebhookResponse(status="error", reason=str(e))
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check() -> HealthResponse:
-    return HealthResponse(status="healthy")
+    return HealthResponse(
+        status="healthy" if memory.available else "degraded",
+        queue=app.state.queue.stats(),
+        scheduler=app.state.scheduler.stats(),
+        event_loop=loop_monitor.stats(),
+        llm=llm.stats(),
+        context_cache=context_cache.stats(),
+        answer_cache=answer_cache.stats() if answer_cache is not None else None,
+        memory={"circuit": memory.breaker.stats(), "backlog": missed_writes.stats()},
+        replies=await app.state.replies.stats(),
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE_LATEST)
@@ -1,9 +1,10 @@
-from .webhook import WebhookData, WebhookResponse
+from .webhook import WebhookData, WebhookResponse, QueuedMessage
 from .wati import WatiApiResponse, WatiMessage, WatiSendMessageRequest, HealthResponse
 
 __all__ = [
     "WebhookData",
     "WebhookResponse", 
+    "QueuedMessage",
     "WatiApiResponse",
     "WatiMessage",
     "WatiSendMessageRequest",
@@ -55,3 +55,11 @@ class WatiSendMessageRequest(BaseModel):
 
 class HealthResponse(BaseModel):
     status: str
+    queue: Optional[Dict[str, Any]] = None
+    scheduler: Optional[Dict[str, Any]] = None
+    event_loop: Optional[Dict[str, Any]] = None
+    llm: Optional[Dict[str, Any]] = None
+    memory: Optional[Dict[str, Any]] = None
+    context_cache: Optional[Dict[str, Any]] = None
+    replies: Optional[Dict[str, Any]] = None
+    answer_cache: Optional[Dict[str, Any]] = None
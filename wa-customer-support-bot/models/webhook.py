@@ -34,3 +34,13 @@ class WebhookData(BaseModel):
 class WebhookResponse(BaseModel):
     status: str
     reason: Optional[str] = None
+
+class QueuedMessage(BaseModel):
+    message_id: str
+    phone_number: str
+    message_text: str
+    reply_context_id: Optional[str] = None
+    # Failed turns this message was part of, see handle_messages
+    attempts: int = 0
+    # Already added to RecallrAI and the history buffer by one of those turns
+    recorded: bool = False
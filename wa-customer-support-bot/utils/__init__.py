@@ -0,0 +1,45 @@
+from .memory import AsyncMemoryClient, MemoryUnavailableError
+from .wati_client import WatiClient
+from .idempotency import IdempotencyStore, MessageState
+from .work_queue import WorkQueue
+from .scheduler import KeyedScheduler
+from .cache import TTLCache, SessionCache, ContextCache
+from .answer_cache import AnswerCache, CachedAnswer
+from .conversation import ConversationStore
+from .background import BackgroundTaskGroup
+from .prompt import BuiltPrompt, PromptTemplate, build_prompt, count_tokens
+from .loop_monitor import EventLoopMonitor
+from .llm_gateway import LLMGateway
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+from .backlog import WriteBacklog
+from .reply_outbox import ReplyOutbox
+from . import metrics
+
+__all__ = [
+    "AsyncMemoryClient",
+    "MemoryUnavailableError",
+    "WatiClient",
+    "IdempotencyStore",
+    "MessageState",
+    "WorkQueue",
+    "KeyedScheduler",
+    "TTLCache",
+    "SessionCache",
+    "ContextCache",
+    "AnswerCache",
+    "CachedAnswer",
+    "ConversationStore",
+    "BackgroundTaskGroup",
+    "BuiltPrompt",
+    "PromptTemplate",
+    "build_prompt",
+    "count_tokens",
+    "EventLoopMonitor",
+    "LLMGateway",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "CircuitState",
+    "WriteBacklog",
+    "ReplyOutbox",
+    "metrics",
+]
@@ -0,0 +1,149 @@
+import hashlib
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, FrozenSet, NamedTuple, Optional, Set, Tuple
+
+def normalize_question(text: str) -> str:
+    """Lowercase, turn punctuation into spaces and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+def context_fingerprint(context: str, owner: Optional[str] = None) -> str:
+    return hashlib.blake2b(f"{owner or ''}\0{context}".encode(), digest_size=8).hexdigest()
+
+def char_ngrams(text: str, n: int) -> FrozenSet[str]:
+    padded = f" {text} "
+    return frozenset(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+
+class CachedAnswer(NamedTuple):
+    answer: str
+    similarity: float
+
+class _Entry(NamedTuple):
+    answer: str
+    grams: FrozenSet[str]
+    numbers: Tuple[str, ...]
+    answer_words: FrozenSet[str]
+    expires_at: float
+
+class AnswerCache:
+    """
+    Reuses answers to questions that were already answered against the same memory context.
+
+    Entries are keyed by the normalized question and a fingerprint of the context it was
+    answered with and of its `owner`. An entry with an owner is only ever matched for that
+    owner; pass one whenever the answer may depend on who asked. The cache doesn't know
+    about conversation history, so callers must only use it for turns the history can't
+    affect. Within a fingerprint, questions are compared as sets of character n-grams
+    through an inverted index, and the most similar entry is returned if its Jaccard
+    similarity reaches `threshold`. A similar question never matches if its numbers
+    differ (booking ids, dates), or if the cached answer repeats a word of the cached
+    question that the new one lacks (a name, say). Questions shorter than `min_chars` are
+    neither cached nor looked up. Entries expire after `ttl` seconds and the least
+    recently used are evicted past `max_entries`. Meant for use from one event loop.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_entries: int = 5000,
+        threshold: float = 0.8,
+        ngram: int = 3,
+        min_chars: int = 10,
+    ):
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._index: Dict[Tuple[str, str], Set[str]] = {}
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._threshold = threshold
+        self._ngram = ngram
+        self._min_chars = min_chars
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def get(self, question: str, context: str, owner: Optional[str] = None) -> Optional[CachedAnswer]:
+        normalized = normalize_question(question)
+        if len(normalized) < self._min_chars:
+            self.skipped += 1
+            return None
+        fingerprint = context_fingerprint(context, owner)
+        now = time.monotonic()
+        best: Optional[Tuple[float, str]] = None
+        if (fingerprint, normalized) in self._entries:
+            best = (1.0, normalized)
+        else:
+            grams = char_ngrams(normalized, self._ngram)
+            numbers = tuple(re.findall(r"\d+", normalized))
+            words = set(normalized.split())
+            shared: Counter = Counter()
+            for gram in grams:
+                shared.update(self._index.get((fingerprint, gram), ()))
+            for candidate, count in shared.items():
+                # Jaccard can't exceed count / len(grams), skip what can't reach the threshold
+                if count < self._threshold * len(grams):
+                    continue
+                entry = self._entries[(fingerprint, candidate)]
+                if entry.numbers != numbers:
+                    continue
+                # e.g. "hi i'm priya, ..." answered with "Hi Priya, ..."
+                if any(len(word) > 2 and word in entry.answer_words for word in set(candidate.split()) - words):
+                    continue
+                similarity = count / (len(grams) + len(entry.grams) - count)
+                if similarity >= self._threshold and (best is None or similarity > best[0]):
+                    best = (similarity, candidate)
+        if best is not None:
+            key = (fingerprint, best[1])
+            entry = self._entries[key]
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return CachedAnswer(entry.answer, round(best[0], 3))
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def set(self, question: str, context: str, answer: str, owner: Optional[str] = None) -> None:
+        normalized = normalize_question(question)
+        if len(normalized) < self._min_chars:
+            return
+        fingerprint = context_fingerprint(context, owner)
+        key = (fingerprint, normalized)
+        self._remove(key)
+        grams = char_ngrams(normalized, self._ngram)
+        self._entries[key] = _Entry(
+            answer,
+            grams,
+            tuple(re.findall(r"\d+", normalized)),
+            frozenset(normalize_question(answer).split()),
+            time.monotonic() + self._ttl,
+        )
+        for gram in grams:
+            self._index.setdefault((fingerprint, gram), set()).add(normalized)
+        while len(self._entries) > self._max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        fingerprint, normalized = key
+        for gram in entry.grams:
+            questions = self._index.get((fingerprint, gram))
+            if questions is not None:
+                questions.discard(normalized)
+                if not questions:
+                    del self._index[(fingerprint, gram)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Any, Coroutine, Dict, Hashable, Optional, Set
+from logger import get_logger
+
+logger = get_logger()
+
+class BackgroundTaskGroup:
+    """
+    Fire-and-forget tasks that are still tracked.
+
+    Failures are logged instead of being lost, and `drain` waits for outstanding tasks at
+    shutdown. Tasks spawned with a `key` can be awaited with `wait(key)`, which lets a later
+    step on the same conversation wait for earlier background writes to keep them ordered.
+    """
+
+    def __init__(self, name: str = "background"):
+        self._name = name
+        self._tasks: Set[asyncio.Task] = set()
+        self._keyed: Dict[Hashable, asyncio.Task] = {}
+        self._failed = 0
+
+    def spawn(self, coro: Coroutine[Any, Any, Any], description: str, key: Optional[Hashable] = None) -> asyncio.Task:
+        previous = self._keyed.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(coro, description, previous))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            self._keyed[key] = task
+            task.add_done_callback(lambda t: self._keyed.pop(key, None) if self._keyed.get(key) is t else None)
+        return task
+
+    async def wait(self, key: Hashable) -> None:
+        """Wait for the background tasks spawned with `key`. Their failures are not re-raised."""
+        task = self._keyed.get(key)
+        if task is not None:
+            await asyncio.shield(asyncio.wait([task]))
+
+    async def drain(self, timeout: Optional[float] = 30.0) -> None:
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"{self._name}: {len(pending)} background task(s) still running at shutdown")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": len(self._tasks), "failed": self._failed}
+
+    async def _run(self, coro: Coroutine[Any, Any, Any], description: str, previous: Optional[asyncio.Task]) -> None:
+        # Tasks sharing a key run in the order they were spawned
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await coro
+        except Exception as e:
+            self._failed += 1
+            logger.error(f"{self._name}: {description} failed: {e}")
@@ -0,0 +1,92 @@
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Hashable, Iterable, List, Tuple
+
+# (role, content) of one message to add to a session
+PendingWrite = Tuple[str, str]
+
+class WriteBacklog:
+    """
+    Memory writes that couldn't be made while RecallrAI was unavailable, queued per
+    conversation in the order they happened so they can be replayed once it recovers.
+
+    Writes stay queued until they are acknowledged: `peek` returns them with a sequence id,
+    and `ack` removes the write with that id once it was replayed, so a write dropped
+    meanwhile can't make an ack remove the wrong one. `lock(key)` keeps two replays of the
+    same conversation from interleaving, and stays in place while anyone holds or waits for
+    it. The backlog is bounded: past `max_per_key` the oldest writes of a conversation are
+    dropped, past `max_keys` the conversation that was queued first.
+    """
+
+    def __init__(self, max_keys: int = 10_000, max_per_key: int = 200):
+        self._pending: "OrderedDict[Hashable, Deque[Tuple[int, PendingWrite]]]" = OrderedDict()
+        self._next_seq = itertools.count()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._lock_users: Dict[Hashable, int] = {}
+        self._max_keys = max_keys
+        self._max_per_key = max_per_key
+        self.replayed = 0
+        self.dropped = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    def __len__(self) -> int:
+        return sum(len(writes) for writes in self._pending.values())
+
+    def add(self, key: Hashable, writes: Iterable[PendingWrite]) -> None:
+        queue = self._pending.get(key)
+        if queue is None:
+            queue = self._pending[key] = deque()
+            while len(self._pending) > self._max_keys:
+                _, evicted = self._pending.popitem(last=False)
+                self.dropped += len(evicted)
+        for write in writes:
+            if len(queue) >= self._max_per_key:
+                queue.popleft()
+                self.dropped += 1
+            queue.append((next(self._next_seq), write))
+
+    def peek(self, key: Hashable) -> List[Tuple[int, PendingWrite]]:
+        """The queued writes of `key`, oldest first, with the sequence ids to `ack` them by"""
+        return list(self._pending.get(key, ()))
+
+    def ack(self, key: Hashable, seq: int) -> None:
+        """Remove the write `seq` of `key` once it has been replayed, unless it was already dropped"""
+        queue = self._pending.get(key)
+        if not queue:
+            return
+        for index, (queued_seq, _) in enumerate(queue):
+            if queued_seq == seq:
+                del queue[index]
+                self.replayed += 1
+                break
+        if not queue:
+            del self._pending[key]
+
+    def keys(self) -> List[Hashable]:
+        return list(self._pending)
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable) -> AsyncIterator[None]:
+        """Hold while replaying `key`"""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "conversations": len(self._pending),
+            "writes": len(self),
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,140 @@
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+class TTLCache(Generic[V]):
+    """
+    In-process LRU cache whose entries also expire after a TTL.
+
+    Reads refresh an entry's LRU position but not its expiry; writes reset both.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl: float = 300):
+        self._entries: "OrderedDict[Hashable, Tuple[V, float]]" = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (value, time.monotonic() + (self._ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class SessionCache(TTLCache[V]):
+    """
+    Caches RecallrAI session handles between messages.
+
+    A PENDING session is auto-processed `auto_process_after_minutes` after its last
+    activity, after which it rejects new messages. Entries therefore never outlive that
+    window (minus a safety margin), and callers `touch` an entry every time they use the
+    session. Callers must `invalidate` on `InvalidSessionStateError`, which covers a
+    session that was processed early (e.g. manually).
+    """
+
+    def __init__(
+        self,
+        auto_process_after_minutes: int,
+        max_entries: int = 10_000,
+        ttl: float = 240,
+        safety_margin: float = 30,
+    ):
+        super().__init__(max_entries=max_entries, ttl=max(0, min(ttl, auto_process_after_minutes * 60 - safety_margin)))
+
+    def touch(self, key: Hashable, value: V) -> None:
+        """Store or refresh an entry after the session saw activity"""
+        self.set(key, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        self.pop(key)
+
+class ContextCache:
+    """
+    Cache in front of `session.get_context()`.
+
+    RecallrAI builds a session's context from the user's long-term memory, which only
+    changes when one of their sessions is processed, plus the session itself. Two entries
+    are kept per user to match:
+      - a memory generation, bumped by `memory_changed`. A context fetched under an older
+        generation no longer matches, even if the fetch was still in flight when the bump
+        happened.
+      - the context of their current session, which expires after `ttl` seconds to pick up
+        whatever else changes it.
+    Meant for use from one event loop.
+    """
+
+    def __init__(self, ttl: float = 300, max_users: int = 10_000):
+        self._contexts: TTLCache[Tuple[str, int, Any]] = TTLCache(max_entries=max_users, ttl=ttl)
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._max_users = max_users
+        self._next_generation = itertools.count(1)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def generation(self, user_id: Hashable) -> int:
+        """Take this before fetching a context and pass it to `set`"""
+        return self._generations.get(user_id, 0)
+
+    def get(self, user_id: Hashable, session_id: Hashable) -> Optional[Any]:
+        entry = self._contexts.get(user_id)
+        if entry is not None and entry[0] == str(session_id) and entry[1] == self._generations.get(user_id, 0):
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        return None
+
+    def set(self, user_id: Hashable, session_id: Hashable, context: Any, generation: int) -> None:
+        if generation == self._generations.get(user_id, 0):
+            self._contexts.set(user_id, (str(session_id), generation, context))
+
+    def memory_changed(self, user_id: Hashable) -> None:
+        """The user's long-term memory changed, e.g. one of their sessions was processed"""
+        # Generations come from one counter, so one that was evicted and restarts at 0 can't match an old entry
+        self._generations[user_id] = next(self._next_generation)
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > self._max_users:
+            self._generations.popitem(last=False)
+        self._contexts.pop(user_id)
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._contexts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,114 @@
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, Optional
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the breaker is open"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit '{name}' is open, next probe in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """
+    Circuit breaker over a rolling window of the last `window` calls.
+
+    A call counts as bad if it failed or took at least `slow_call_seconds`, so an upstream
+    that slows down trips the breaker before it starts timing out. Once the window holds
+    `minimum_calls` calls and the share of bad ones reaches `failure_rate`, the breaker
+    opens and `before_call` fails fast with `CircuitOpenError`. After `open_seconds` it goes
+    half-open and lets `half_open_calls` probes through: if they are all good it closes,
+    a single bad probe opens it again. Meant for use from one event loop.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        minimum_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 3.0,
+        open_seconds: float = 15.0,
+        half_open_calls: int = 1,
+        on_state_change: Optional[Callable[["CircuitBreaker"], None]] = None,
+    ):
+        self.name = name
+        self.state = CircuitState.CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._minimum_calls = minimum_calls
+        self._failure_rate = failure_rate
+        self._slow_call_seconds = slow_call_seconds
+        self._open_seconds = open_seconds
+        self._half_open_calls = half_open_calls
+        self._on_state_change = on_state_change
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def before_call(self) -> None:
+        """Let a call through or raise `CircuitOpenError`. Every call let through must end in `record` or `release`."""
+        if self.state is CircuitState.OPEN:
+            retry_in = self._opened_at + self._open_seconds - time.monotonic()
+            if retry_in > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, retry_in)
+            self._set_state(CircuitState.HALF_OPEN)
+        if self.state is CircuitState.HALF_OPEN:
+            if self._probes >= self._half_open_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, 0.0)
+            self._probes += 1
+
+    def record(self, duration: float, failed: bool) -> None:
+        """Record the outcome of a call that was let through"""
+        bad = failed or duration >= self._slow_call_seconds
+        if self.state is CircuitState.HALF_OPEN:
+            if bad:
+                self._open()
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self._half_open_calls:
+                    self._outcomes.clear()
+                    self._set_state(CircuitState.CLOSED)
+            return
+        if self.state is CircuitState.OPEN:
+            # Started before the breaker opened, it says nothing about recovery
+            return
+        self._outcomes.append(bad)
+        if len(self._outcomes) >= self._minimum_calls and sum(self._outcomes) / len(self._outcomes) >= self._failure_rate:
+            self._open()
+
+    def release(self) -> None:
+        """Give back a call that was let through but ended without an outcome, e.g. cancelled"""
+        if self.state is CircuitState.HALF_OPEN and self._probes > self._probe_successes:
+            self._probes -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state.value,
+            "window_calls": len(self._outcomes),
+            "window_bad_calls": sum(self._outcomes),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        self._set_state(CircuitState.OPEN)
+
+    def _set_state(self, state: CircuitState) -> None:
+        self.state = state
+        self._probes = 0
+        self._probe_successes = 0
+        if self._on_state_change is not None:
+            self._on_state_change(self)
@@ -0,0 +1,33 @@
+from typing import Dict, Hashable, Iterable, List, Optional
+from recallrai.models import Message
+from .cache import TTLCache
+
+class ConversationStore:
+    """
+    Local, append-only copy of each session's messages, ready to pass to the LLM.
+
+    A buffer is seeded once from `session.get_messages()` and then kept up to date by
+    appending every message we add to RecallrAI, so a turn costs no transfer or parsing
+    of the history. Buffers are reconciled lazily: each one expires `reconcile_interval`
+    seconds after it was seeded, and the next turn re-seeds it from RecallrAI.
+    """
+
+    def __init__(self, max_sessions: int = 10_000, reconcile_interval: float = 600):
+        self._buffers: TTLCache[List[Dict[str, str]]] = TTLCache(max_entries=max_sessions, ttl=reconcile_interval)
+
+    def get(self, session_id: Hashable) -> Optional[List[Dict[str, str]]]:
+        return self._buffers.get(str(session_id))
+
+    def seed(self, session_id: Hashable, messages: Iterable[Message]) -> List[Dict[str, str]]:
+        buffer = [{"role": message.role.value, "content": message.content} for message in messages]
+        self._buffers.set(str(session_id), buffer)
+        return buffer
+
+    def append(self, session_id: Hashable, role: str, content: str) -> None:
+        buffer = self._buffers.get(str(session_id))
+        # Without a buffer there's nothing to keep in sync, the next turn seeds from RecallrAI
+        if buffer is not None:
+            buffer.append({"role": role, "content": content})
+
+    def stats(self):
+        return self._buffers.stats()
@@ -0,0 +1,120 @@
+import asyncio
+import enum
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+class MessageState(str, enum.Enum):
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+
+class IdempotencyStore:
+    """
+    Deduplicates inbound WATI messages by message id.
+
+    A message is first `claim`ed (recorded as in-flight), then either `complete`d once a
+    reply went out or `release`d on failure so a WATI retry can try again. Any claim on an
+    id that is in-flight or done is refused. In-flight entries expire quickly so a crashed
+    worker doesn't block a message forever; done entries are kept for `done_ttl` seconds.
+
+    The in-memory tier is an LRU bounded by `max_entries`. When `db_path` is set, a SQLite
+    tier is shared by every process pointing at the same file, which keeps deduplication
+    working across restarts and multiple uvicorn workers.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_entries: int = 100_000,
+        in_flight_ttl: float = 300,
+        done_ttl: float = 7 * 24 * 3600,
+        purge_interval: float = 3600,
+    ):
+        self._entries: "OrderedDict[str, Tuple[MessageState, float]]" = OrderedDict()
+        self._max_entries = max_entries
+        self._in_flight_ttl = in_flight_ttl
+        self._done_ttl = done_ttl
+        self._purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages ("
+                "message_id TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    async def claim(self, message_id: str) -> bool:
+        """Mark a message as in-flight. Returns False if it is already in-flight or done."""
+        now = time.time()
+        entry = self._entries.get(message_id)
+        if entry is not None:
+            if entry[1] > now:
+                self._entries.move_to_end(message_id)
+                return False
+            del self._entries[message_id]
+        
+        if self._db is not None and not await asyncio.to_thread(self._db_claim, message_id, now):
+            return False
+        
+        self._set(message_id, MessageState.IN_FLIGHT, now + self._in_flight_ttl)
+        return True
+
+    async def complete(self, message_id: str) -> None:
+        """Mark a claimed message as done"""
+        expires_at = time.time() + self._done_ttl
+        self._set(message_id, MessageState.DONE, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_complete, message_id, expires_at)
+
+    async def release(self, message_id: str) -> None:
+        """Drop an in-flight claim so the message can be processed again"""
+        entry = self._entries.get(message_id)
+        if entry is not None and entry[0] == MessageState.IN_FLIGHT:
+            del self._entries[message_id]
+        if self._db is not None:
+            await asyncio.to_thread(self._db_release, message_id)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+
+    def _set(self, message_id: str, state: MessageState, expires_at: float) -> None:
+        self._entries[message_id] = (state, expires_at)
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _db_claim(self, message_id: str, now: float) -> bool:
+        with self._db_lock:
+            # A single upsert is atomic across processes: it only takes over rows that have expired
+            cursor = self._db.execute(
+                "INSERT INTO processed_messages (message_id, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at "
+                "WHERE processed_messages.expires_at <= ?",
+                (message_id, MessageState.IN_FLIGHT.value, now + self._in_flight_ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def _db_complete(self, message_id: str, expires_at: float) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO processed_messages (message_id, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+                (message_id, MessageState.DONE.value, expires_at),
+            )
+            now = time.time()
+            if now - self._last_purge > self._purge_interval:
+                self._db.execute("DELETE FROM processed_messages WHERE expires_at <= ?", (now,))
+                self._last_purge = now
+
+    def _db_release(self, message_id: str) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "DELETE FROM processed_messages WHERE message_id = ? AND state = ?",
+                (message_id, MessageState.IN_FLIGHT.value),
+            )
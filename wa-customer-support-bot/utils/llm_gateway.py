@@ -0,0 +1,258 @@
+import asyncio
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Mapping, Optional
+import openai
+from logger import get_logger
+from utils import metrics
+
+logger = get_logger()
+
+# Overload signals: back off and shrink the concurrency limit
+OVERLOAD_STATUS_CODES = {429, 503}
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset headers like '1s', '6m0s' or '250ms' into seconds"""
+    if not value:
+        return None
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    if "retry-after-ms" in headers:
+        return float(headers["retry-after-ms"]) / 1000
+    return parse_duration(headers.get("retry-after"))
+
+def cached_tokens(usage: Any) -> int:
+    """Prompt tokens OpenAI served from its prompt cache, 0 if the usage doesn't say"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+class AsyncTokenBucket:
+    """Token bucket refilled at `per_minute / 60` per second, holding up to 10 seconds worth of tokens"""
+
+    def __init__(self, per_minute: float):
+        self.set_rate(per_minute)
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+
+    def set_rate(self, per_minute: float) -> None:
+        self._rate = per_minute / 60
+        self._capacity = max(1.0, self._rate * 10)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        tokens = min(tokens, self._capacity)
+        while True:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self._tokens) / self._rate)
+
+    def clamp(self, remaining: float) -> None:
+        """Never believe we have more budget than the server says is left"""
+        self._refill()
+        self._tokens = min(self._tokens, remaining)
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: every success raises the limit by 1/limit (about +1 per round
+    of requests), an overload signal halves it. Overloads within `decrease_interval` of
+    the last cut count as the same congestion event, so a burst of 429s halves it once.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease_interval: float = 1.0):
+        self.limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._decrease_interval = decrease_interval
+        self._last_decrease = 0.0
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot just as we got cancelled, pass it on
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, overloaded: bool = False) -> None:
+        self.in_flight -= 1
+        if overloaded:
+            now = time.monotonic()
+            if now - self._last_decrease >= self._decrease_interval:
+                self.limit = max(self._minimum, self.limit / 2)
+                self._last_decrease = now
+        else:
+            self.limit = min(self._maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+class LLMGateway:
+    """
+    Single entry point for chat completions.
+
+    Requests wait for a slot under an adaptive concurrency limit and for request/token
+    budget from two token buckets, then run with the OpenAI client's own retries disabled.
+    The rate-limit headers of every response keep the buckets in sync with what OpenAI
+    reports. 429s, 5xx and timeouts are retried with full-jitter exponential backoff (or
+    the server's retry-after), and overload responses also halve the concurrency limit.
+    """
+
+    def __init__(
+        self,
+        client: openai.AsyncOpenAI,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 64,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+    ):
+        # Retries happen here, where they are paced and counted
+        self._client = client.with_options(max_retries=0)
+        self._limiter = AdaptiveLimiter(initial_concurrency, min_concurrency, max_concurrency)
+        # Limits that aren't configured are picked up from the response headers
+        self._configured = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self._buckets: Dict[str, Optional[AsyncTokenBucket]] = {
+            kind: AsyncTokenBucket(per_minute) if per_minute else None
+            for kind, per_minute in self._configured.items()
+        }
+        self._paused_until = 0.0
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._calls = 0
+        self._retries = 0
+        self._throttled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._prompt_tokens = 0
+        self._cached_prompt_tokens = 0
+        metrics.LLM_CONCURRENCY_LIMIT.set_function(lambda: self._limiter.limit)
+
+    async def create(self, estimated_tokens: int = 0, **kwargs) -> Any:
+        """`chat.completions.create` with pacing and retries. `estimated_tokens` is charged against the token budget."""
+        for attempt in range(self._max_retries + 1):
+            await self._wait_for_budget(estimated_tokens)
+            overloaded = False
+            try:
+                with metrics.upstream_call("openai", "chat.completions"):
+                    raw = await self._client.chat.completions.with_raw_response.create(**kwargs)
+                self._sync_with_headers(raw.headers)
+                response = raw.parse()
+                self._record_usage(response.usage)
+                return response
+            except (openai.APIStatusError, openai.APIConnectionError) as e:
+                status = e.status_code if isinstance(e, openai.APIStatusError) else None
+                overloaded = status in OVERLOAD_STATUS_CODES or isinstance(e, openai.APITimeoutError)
+                if (status is not None and status not in RETRYABLE_STATUS_CODES) or attempt == self._max_retries:
+                    raise
+                self._retries += 1
+                metrics.LLM_RETRIES.labels(str(status) if status else type(e).__name__).inc()
+                delay = random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+                if status is not None:
+                    delay = max(delay, retry_after(e.response.headers) or 0.0)
+                if status == 429:
+                    self._throttled += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"OpenAI call failed ({status or type(e).__name__}), retry {attempt + 1}/{self._max_retries} in {delay:.2f}s")
+            finally:
+                self._limiter.release(overloaded)
+            await asyncio.sleep(delay)
+
+    async def _wait_for_budget(self, estimated_tokens: int) -> None:
+        started = time.perf_counter()
+        await self._limiter.acquire()
+        try:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if self._buckets["requests"] is not None:
+                await self._buckets["requests"].acquire(1)
+            if self._buckets["tokens"] is not None and estimated_tokens:
+                await self._buckets["tokens"].acquire(estimated_tokens)
+        except BaseException:
+            self._limiter.release()
+            raise
+        waited = time.perf_counter() - started
+        self._calls += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        metrics.LLM_QUEUE_WAIT.observe(waited)
+
+    def _record_usage(self, usage: Any) -> None:
+        if usage is None:
+            return
+        cached = cached_tokens(usage)
+        self._prompt_tokens += usage.prompt_tokens
+        self._cached_prompt_tokens += cached
+        metrics.LLM_PROMPT_TOKENS.labels("cached").inc(cached)
+        metrics.LLM_PROMPT_TOKENS.labels("uncached").inc(max(usage.prompt_tokens - cached, 0))
+
+    def _sync_with_headers(self, headers: Mapping[str, str]) -> None:
+        for kind, bucket in self._buckets.items():
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if limit and not self._configured[kind]:
+                if bucket is None:
+                    bucket = self._buckets[kind] = AsyncTokenBucket(float(limit))
+                else:
+                    bucket.set_rate(float(limit))
+            if bucket is not None and remaining is not None:
+                bucket.clamp(float(remaining))
+                if float(remaining) <= 0:
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 1.0
+                    self._paused_until = max(self._paused_until, time.monotonic() + reset)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": round(self._limiter.limit, 2),
+            "in_flight": self._limiter.in_flight,
+            "waiting": self._limiter.waiting,
+            "calls": self._calls,
+            "retries": self._retries,
+            "throttled": self._throttled,
+            "avg_queue_wait_seconds": self._total_wait / self._calls if self._calls else 0.0,
+            "max_queue_wait_seconds": self._max_wait,
+            "prompt_tokens": self._prompt_tokens,
+            "cached_prompt_tokens": self._cached_prompt_tokens,
+            "prompt_cache_hit_rate": round(self._cached_prompt_tokens / self._prompt_tokens, 3) if self._prompt_tokens else 0.0,
+        }
@@ -0,0 +1,48 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+class EventLoopMonitor:
+    """
+    Measures event-loop lag: how late a `sleep(interval)` wakes up compared to when it was
+    due. Sustained lag means something is blocking the loop (sync I/O, heavy CPU work) and
+    every in-flight webhook and upstream call is being delayed by it. Samples from the last
+    `window` seconds are kept for `stats()`.
+    """
+
+    def __init__(self, interval: float = 0.25, window: float = 60.0):
+        self._interval = interval
+        self._window = window
+        self._samples: Deque[Tuple[float, float]] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self._interval)
+            now = time.perf_counter()
+            self._samples.append((now, max(0.0, now - started - self._interval)))
+            while self._samples and self._samples[0][0] < now - self._window:
+                self._samples.popleft()
+
+    def stats(self) -> Dict[str, Any]:
+        lags = sorted(lag for _, lag in self._samples)
+        if not lags:
+            return {"samples": 0, "lag_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(lags),
+            "lag_ms": round(self._samples[-1][1] * 1000, 2),
+            "p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+            "max_ms": round(lags[-1] * 1000, 2),
+        }
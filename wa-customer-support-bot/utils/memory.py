@@ -0,0 +1,147 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, TypeVar
+from recallrai import RecallrAI
+from recallrai.user import User
+from recallrai.session import Session
+from recallrai.models import Context, Message, SessionStatus
+from recallrai.exceptions import RecallrAIError, NetworkError, ServerError, UserNotFoundError, UserAlreadyExistsError
+from logger import get_logger
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+from utils.metrics import MEMORY_CIRCUIT_STATE, upstream_call
+
+T = TypeVar("T")
+
+logger = get_logger()
+
+class MemoryUnavailableError(Exception):
+    """RecallrAI is failing or too slow, or its circuit breaker is open"""
+
+    def __init__(self, operation: str):
+        super().__init__(f"RecallrAI is unavailable for {operation}")
+        self.operation = operation
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Errors that say RecallrAI itself is unhealthy, unlike e.g. a user that doesn't exist yet"""
+    if isinstance(error, (asyncio.TimeoutError, NetworkError, ServerError)):
+        return True
+    return isinstance(error, RecallrAIError) and (error.http_status or 0) >= 500
+
+class AsyncMemoryClient:
+    """
+    Async adapter over the synchronous RecallrAI client.
+
+    Every SDK call runs on a bounded thread pool so the event loop keeps serving other
+    webhooks while a memory round-trip is in flight. Each call is also capped by a
+    per-call timeout. A call that times out keeps its worker thread until the SDK's own
+    HTTP timeout fires, which is why the pool is bounded.
+
+    All calls go through one circuit breaker, since an outage or slowdown of RecallrAI hits
+    every operation. Timeouts, network errors and 5xx responses count against it, as do
+    calls slower than `breaker_slow_call_seconds`; control-flow errors like
+    `UserNotFoundError` don't. Any of those failures, and every call made while the breaker
+    is open, surfaces as `MemoryUnavailableError`.
+    """
+
+    def __init__(
+        self,
+        client: RecallrAI,
+        max_workers: int = 32,
+        call_timeout: float = 5.0,
+        breaker_window: int = 20,
+        breaker_minimum_calls: int = 5,
+        breaker_failure_rate: float = 0.5,
+        breaker_slow_call_seconds: float = 3.0,
+        breaker_open_seconds: float = 15.0,
+        breaker_half_open_calls: int = 1,
+    ):
+        self._client = client
+        self._call_timeout = call_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recallrai")
+        self.breaker = CircuitBreaker(
+            "recallrai",
+            window=breaker_window,
+            minimum_calls=breaker_minimum_calls,
+            failure_rate=breaker_failure_rate,
+            slow_call_seconds=breaker_slow_call_seconds,
+            open_seconds=breaker_open_seconds,
+            half_open_calls=breaker_half_open_calls,
+            on_state_change=self._on_state_change,
+        )
+        MEMORY_CIRCUIT_STATE.state(self.breaker.state.value)
+
+    async def run(self, fn: Callable[..., T], *args, timeout: Optional[float] = None, **kwargs) -> T:
+        """Run a blocking SDK call on the pool, behind the circuit breaker, and await its result"""
+        operation = fn.__name__
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            raise MemoryUnavailableError(operation) from e
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            with upstream_call("recallrai", operation):
+                future = loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+                result = await asyncio.wait_for(future, timeout or self._call_timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            failed = is_upstream_failure(e)
+            self.breaker.record(time.perf_counter() - started, failed=failed)
+            if failed:
+                raise MemoryUnavailableError(operation) from e
+            raise
+        self.breaker.record(time.perf_counter() - started, failed=False)
+        return result
+
+    def _on_state_change(self, breaker: CircuitBreaker) -> None:
+        MEMORY_CIRCUIT_STATE.state(breaker.state.value)
+        logger.warning(f"RecallrAI circuit breaker is now {breaker.state.value}")
+
+    @property
+    def available(self) -> bool:
+        """False while the breaker is open or probing"""
+        return self.breaker.state is CircuitState.CLOSED
+
+    async def get_or_create_user(self, user_id: str) -> User:
+        """Get a user by ID, creating it on first contact"""
+        try:
+            return await self.run(self._client.get_user, user_id)
+        except UserNotFoundError:
+            try:
+                return await self.run(self._client.create_user, user_id)
+            except UserAlreadyExistsError:
+                # Another worker created the user between our two calls
+                return await self.run(self._client.get_user, user_id)
+
+    async def get_active_session(self, user: User, auto_process_after_minutes: int) -> Session:
+        """Return the user's most recent session if it is still PENDING, else start a new one"""
+        sessions = (await self.run(user.list_sessions, offset=0, limit=1)).sessions
+        if sessions and sessions[0].status == SessionStatus.PENDING:
+            return await self.run(user.get_session, sessions[0].session_id)
+        return await self.run(user.create_session, auto_process_after_minutes=auto_process_after_minutes)
+
+    async def add_user_message(self, session: Session, message: str) -> None:
+        await self.run(session.add_user_message, message)
+
+    async def add_assistant_message(self, session: Session, message: str) -> None:
+        await self.run(session.add_assistant_message, message)
+
+    async def add_message(self, session: Session, role: str, message: str) -> None:
+        if role == "assistant":
+            await self.add_assistant_message(session, message)
+        else:
+            await self.add_user_message(session, message)
+
+    async def get_messages(self, session: Session) -> List[Message]:
+        return await self.run(session.get_messages)
+
+    async def get_context(self, session: Session) -> Context:
+        return await self.run(session.get_context)
+
+    def close(self) -> None:
+        """Stop accepting work and drop queued calls"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,124 @@
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Iterator, TypeVar
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Enum, Gauge, Histogram, generate_latest
+
+T = TypeVar("T")
+
+# Stages are milliseconds to tens of seconds (the LLM call, a coalesced turn)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_DURATION = Histogram(
+    "wa_bot_stage_duration_seconds",
+    "Time spent in each stage of webhook handling and the reply pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_DURATION = Histogram(
+    "wa_bot_upstream_duration_seconds",
+    "Latency of calls to WATI, OpenAI and RecallrAI",
+    ["upstream", "operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+WEBHOOKS = Counter(
+    "wa_bot_webhooks_total",
+    "Webhooks received, by what happened to them",
+    ["outcome"],
+)
+TURNS = Counter(
+    "wa_bot_turns_total",
+    "Assistant turns run by the pipeline, by outcome",
+    ["outcome"],
+)
+TURNS_IN_FLIGHT = Gauge(
+    "wa_bot_turns_in_flight",
+    "Assistant turns currently being processed",
+)
+QUEUE_DEPTH = Gauge(
+    "wa_bot_queue_depth",
+    "Accepted messages waiting for a worker",
+)
+EVENT_LOOP_LAG = Gauge(
+    "wa_bot_event_loop_lag_seconds",
+    "Most recent event-loop lag sample",
+)
+LLM_QUEUE_WAIT = Histogram(
+    "wa_bot_llm_queue_wait_seconds",
+    "Time a completion waited for a concurrency slot and rate-limit budget",
+    buckets=LATENCY_BUCKETS,
+)
+LLM_RETRIES = Counter(
+    "wa_bot_llm_retries_total",
+    "Retried OpenAI calls, by status code or error type",
+    ["reason"],
+)
+LLM_PROMPT_TOKENS = Counter(
+    "wa_bot_llm_prompt_tokens_total",
+    "Prompt tokens sent to OpenAI, by whether OpenAI served them from its prompt cache",
+    ["cache"],
+)
+LLM_CONCURRENCY_LIMIT = Gauge(
+    "wa_bot_llm_concurrency_limit",
+    "Current adaptive concurrency limit for OpenAI calls",
+)
+REPLY_DELIVERIES = Counter(
+    "wa_bot_reply_deliveries_total",
+    "Attempts to deliver a reply from the outbox, by outcome",
+    ["outcome"],
+)
+REPLY_DELIVERY_DELAY = Histogram(
+    "wa_bot_reply_delivery_delay_seconds",
+    "Time from a reply entering the outbox until WATI accepted it",
+    buckets=LATENCY_BUCKETS,
+)
+CONTEXT_CACHE = Counter(
+    "wa_bot_context_cache_lookups_total",
+    "RecallrAI context lookups, by whether the context cache had them",
+    ["result"],
+)
+ANSWER_CACHE = Counter(
+    "wa_bot_answer_cache_lookups_total",
+    "Answer cache lookups, by whether a cached answer was reused",
+    ["result"],
+)
+MEMORY_CIRCUIT_STATE = Enum(
+    "wa_bot_memory_circuit_state",
+    "State of the circuit breaker in front of RecallrAI",
+    states=["closed", "open", "half_open"],
+)
+DEGRADED_TURNS = Counter(
+    "wa_bot_degraded_turns_total",
+    "Turns answered without RecallrAI memory because it was unavailable",
+)
+MEMORY_BACKLOG = Gauge(
+    "wa_bot_memory_backlog_writes",
+    "Memory writes queued for replay until RecallrAI recovers",
+)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block into the stage histogram, whether it succeeds or not"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+@contextmanager
+def upstream_call(upstream: str, operation: str) -> Iterator[None]:
+    """Time one upstream call, labelled with whether it raised"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        UPSTREAM_DURATION.labels(upstream, operation, outcome).observe(time.perf_counter() - started)
+
+async def timed(stage: str, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable` inside a span, for stages that run concurrently under `asyncio.gather`"""
+    with span(stage):
+        return await awaitable
+
+def render_metrics() -> bytes:
+    return generate_latest()
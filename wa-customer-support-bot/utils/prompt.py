@@ -0,0 +1,168 @@
+# Token budgeting shared by the email agent and the WhatsApp bot. Each example is built from its own
+# directory and has to stand alone, so both keep an identical copy of this file: change them together.
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to the character-based estimate below
+    tiktoken = None
+
+# Rough per-message cost of the chat format (role, separators) on top of the content
+MESSAGE_OVERHEAD_TOKENS = 4
+TOKEN_COUNT_CACHE_SIZE = 50_000
+
+# Keyed by a digest of the text rather than the text, so cached counts don't keep large contexts alive
+_token_counts: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+class PromptTemplate(BaseModel):
+    """
+    A system prompt laid out for provider-side prompt caching.
+
+    OpenAI reuses the longest prefix of a prompt it has recently seen (from 1024 tokens on),
+    so what never changes goes first: `instructions` is sent as its own system message,
+    byte-for-byte the same on every request, right after the tool schemas. The per-user
+    part, `memory_template` with its `{context}` placeholder, follows in a second system
+    message, and the history after that only grows at the end between turns. Keep anything
+    that varies (dates, names, ids) out of `instructions`.
+    """
+    instructions: str
+    memory_template: str = "MEMORIES ABOUT THE USER:\n{context}"
+
+    def system_messages(self, context: str) -> List[Dict[str, Any]]:
+        return [
+            {"role": "system", "content": self.instructions},
+            {"role": "system", "content": self.memory_template.format(context=context)},
+        ]
+
+class BuiltPrompt(BaseModel):
+    messages: List[Dict[str, Any]]
+    prompt_tokens: int
+    trimmed_tokens: int = 0
+    dropped_messages: int = 0
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # tiktoken fetches encodings on first use, which can fail without network access
+        return None
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Count tokens locally, estimating ~4 characters per token if no tokenizer is available"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    key = (model, hashlib.blake2b(text.encode(), digest_size=16).digest())
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+            return count
+    count = len(encoding.encode(text, disallowed_special=()))
+    with _token_counts_lock:
+        _token_counts[key] = count
+        if len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return count
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> str:
+    """Keep the beginning of `text` that fits in `max_tokens`"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+def _message_tokens(message: Dict[str, Any], model: str) -> int:
+    return count_tokens(message.get("content") or "", model) + MESSAGE_OVERHEAD_TOKENS
+
+def _compact(messages: List[Dict[str, Any]], max_tokens: int, model: str) -> Optional[Dict[str, Any]]:
+    """Fold dropped turns into one short note, keeping the most recent of them first"""
+    header = "Earlier in this conversation (older messages condensed):"
+    budget = max_tokens - count_tokens(header, model) - MESSAGE_OVERHEAD_TOKENS
+    lines = []
+    for message in reversed(messages):
+        content = " ".join((message.get("content") or "").split())
+        if not content:
+            continue
+        line = f"- {message['role']}: {truncate_to_tokens(content, 40, model)}"
+        cost = count_tokens(line, model) + 1
+        if cost > budget:
+            break
+        lines.append(line)
+        budget -= cost
+    if not lines:
+        return None
+    return {"role": "system", "content": "\n".join([header, *reversed(lines)])}
+
+def build_prompt(
+    template: PromptTemplate,
+    context: str,
+    history: List[Dict[str, Any]],
+    max_tokens: int,
+    max_context_tokens: int,
+    summary_tokens: int = 200,
+    model: str = "gpt-4o-mini",
+) -> BuiltPrompt:
+    """
+    Assemble the chat messages for a completion within a token budget.
+
+    The messages are the template's static instructions, the memory context capped at
+    `max_context_tokens`, then the history. History is kept newest-first until the budget runs out;
+    older turns that don't fit are dropped and condensed into a note of at most
+    `summary_tokens`. The latest message is always kept, truncated if it has to be.
+    """
+    trimmed_tokens = 0
+    
+    context_tokens = count_tokens(context, model)
+    if context_tokens > max_context_tokens:
+        context = truncate_to_tokens(context, max_context_tokens, model)
+        trimmed_tokens += context_tokens - count_tokens(context, model)
+    
+    system_messages = template.system_messages(context)
+    remaining = max_tokens - sum(_message_tokens(message, model) for message in system_messages)
+    
+    history_tokens = [_message_tokens(message, model) for message in history]
+    if len(history) > 1 and sum(history_tokens) > remaining:
+        # Some turns will be dropped, so leave room for the note that condenses them
+        remaining -= summary_tokens
+    
+    kept: List[Dict[str, Any]] = []
+    for message, tokens in zip(reversed(history), reversed(history_tokens)):
+        if tokens > remaining:
+            if not kept:
+                content = truncate_to_tokens(message.get("content") or "", remaining - MESSAGE_OVERHEAD_TOKENS, model)
+                trimmed_tokens += tokens - count_tokens(content, model) - MESSAGE_OVERHEAD_TOKENS
+                kept.append({**message, "content": content})
+            break
+        kept.append(message)
+        remaining -= tokens
+    kept.reverse()
+    
+    dropped = history[:len(history) - len(kept)]
+    summary = _compact(dropped, summary_tokens, model) if dropped else None
+    trimmed_tokens += sum(history_tokens[:len(dropped)]) - (_message_tokens(summary, model) if summary else 0)
+    
+    messages = [*system_messages, *([summary] if summary else []), *kept]
+    return BuiltPrompt(
+        messages=messages,
+        prompt_tokens=sum(_message_tokens(message, model) for message in messages),
+        trimmed_tokens=max(trimmed_tokens, 0),
+        dropped_messages=len(dropped),
+    )
@@ -0,0 +1,222 @@
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from logger import get_logger
+from models import WatiSendMessageRequest
+from utils import metrics
+
+logger = get_logger()
+
+# Anything else in the 4xx range won't succeed on a retry
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429}
+
+class ReplyOutbox:
+    """
+    Durable outbox for outgoing WhatsApp replies.
+
+    `enqueue` persists a generated reply in SQLite and returns; a background sender
+    delivers it, so a WATI error never costs the completion that produced the reply.
+    Every reply has an idempotency key (the message it answers), and enqueueing a key
+    that is already known is a no-op. Failed sends are retried with full-jitter
+    exponential backoff, and a reply that fails with a non-retryable status or
+    `max_attempts` times is moved to the `reply_dead_letters` table.
+
+    Replies to one phone number go out in the order they were enqueued: only the oldest
+    undelivered reply of a number is ever sent. Rows are claimed with a lease, so several
+    processes can share the database and a crashed sender's replies are picked up again
+    once the lease runs out. Delivery is at-least-once: a crash between the send and
+    marking it sent delivers that reply twice.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[WatiSendMessageRequest], Awaitable[Any]],
+        db_path: str = "reply_outbox.db",
+        max_attempts: int = 8,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        max_concurrency: int = 16,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 1.0,
+        sent_ttl: float = 24 * 3600,
+    ):
+        self._send = send
+        self._max_attempts = max_attempts
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._max_concurrency = max_concurrency
+        self._lease_seconds = lease_seconds
+        self._poll_interval = poll_interval
+        self._sent_ttl = sent_ttl
+        self._last_purge = 0.0
+        self._deliveries: Set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reply_outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, idempotency_key TEXT NOT NULL UNIQUE, "
+            "phone_number TEXT NOT NULL, message_text TEXT NOT NULL, reply_context_id TEXT, "
+            "sent INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, last_error TEXT, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS reply_outbox_pending ON reply_outbox (sent, phone_number, id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reply_dead_letters ("
+            "id INTEGER PRIMARY KEY, idempotency_key TEXT NOT NULL UNIQUE, "
+            "phone_number TEXT NOT NULL, message_text TEXT NOT NULL, reply_context_id TEXT, "
+            "attempts INTEGER NOT NULL, last_error TEXT, created_at REAL NOT NULL, failed_at REAL NOT NULL)"
+        )
+
+    async def enqueue(self, idempotency_key: str, reply: WatiSendMessageRequest) -> bool:
+        """Persist a reply for delivery. Returns False if a reply with this key was already enqueued."""
+        added = await asyncio.to_thread(self._db_insert, idempotency_key, reply, time.time())
+        if added:
+            self._wake.set()
+        else:
+            logger.info(f"Reply {idempotency_key} to {reply.phone_number} is already in the outbox")
+        return added
+
+    def start(self) -> None:
+        self._sender = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: Optional[float] = 10.0) -> None:
+        """Stop sending and wait for deliveries in progress. Undelivered replies stay in the database."""
+        if self._sender is not None:
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+        if self._deliveries:
+            await asyncio.wait(set(self._deliveries), timeout=drain_timeout)
+
+    def close(self) -> None:
+        self._db.close()
+
+    async def stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._db_stats, time.time())
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            free = self._max_concurrency - len(self._deliveries)
+            rows = await asyncio.to_thread(self._db_claim_due, time.time(), free) if free > 0 else []
+            for row in rows:
+                task = asyncio.create_task(self._deliver(row))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+            if len(rows) < free:
+                # Nothing else is due: sleep until a reply is enqueued, a delivery finishes or the next poll
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._wake.wait()
+
+    async def _deliver(self, row: sqlite3.Row) -> None:
+        reply = WatiSendMessageRequest(
+            phone_number=row["phone_number"],
+            message_text=row["message_text"],
+            reply_context_id=row["reply_context_id"],
+        )
+        try:
+            await self._send(reply)
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            status = getattr(e, "status_code", None)
+            error = f"{type(e).__name__}: {e}"
+            if (status is not None and status < 500 and status not in RETRYABLE_STATUS_CODES) or attempts >= self._max_attempts:
+                logger.error(f"Reply {row['idempotency_key']} to {reply.phone_number} failed for good after {attempts} attempt(s): {error}")
+                await asyncio.to_thread(self._db_dead_letter, row["id"], attempts, error, time.time())
+                metrics.REPLY_DELIVERIES.labels("dead_letter").inc()
+            else:
+                delay = random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** (attempts - 1)))
+                logger.warning(f"Reply {row['idempotency_key']} to {reply.phone_number} failed ({error}), retry {attempts}/{self._max_attempts - 1} in {delay:.1f}s")
+                await asyncio.to_thread(self._db_retry, row["id"], attempts, error, time.time() + delay)
+                metrics.REPLY_DELIVERIES.labels("retry").inc()
+        else:
+            await asyncio.to_thread(self._db_mark_sent, row["id"], time.time())
+            metrics.REPLY_DELIVERIES.labels("sent").inc()
+            metrics.REPLY_DELIVERY_DELAY.observe(time.time() - row["created_at"])
+        finally:
+            # The number's next reply may be waiting on this one
+            self._wake.set()
+
+    def _db_insert(self, idempotency_key: str, reply: WatiSendMessageRequest, now: float) -> bool:
+        with self._db_lock:
+            cursor = self._db.execute(
+                "INSERT INTO reply_outbox (idempotency_key, phone_number, message_text, reply_context_id, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(idempotency_key) DO NOTHING",
+                (idempotency_key, reply.phone_number, reply.message_text, reply.reply_context_id, now, now),
+            )
+            return cursor.rowcount == 1
+
+    def _db_claim_due(self, now: float, limit: int) -> List[sqlite3.Row]:
+        with self._db_lock:
+            # IMMEDIATE takes the write lock up front, so two processes can't claim the same rows
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # The oldest undelivered reply of each number, if it is due. One that is being sent
+                # is leased (not due), which holds back the number's later replies too.
+                claimed = self._db.execute(
+                    "SELECT * FROM reply_outbox AS reply WHERE sent = 0 AND next_attempt_at <= ? AND id = "
+                    "(SELECT MIN(id) FROM reply_outbox WHERE sent = 0 AND phone_number = reply.phone_number) "
+                    "ORDER BY id LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE reply_outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + self._lease_seconds, row["id"]) for row in claimed],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return claimed
+
+    def _db_mark_sent(self, row_id: int, now: float) -> None:
+        with self._db_lock:
+            self._db.execute("UPDATE reply_outbox SET sent = 1, attempts = attempts + 1, next_attempt_at = ? WHERE id = ?", (now, row_id))
+            # Sent rows are only kept to deduplicate enqueues, drop them once nobody will retry that turn
+            if now - self._last_purge > 3600:
+                self._db.execute("DELETE FROM reply_outbox WHERE sent = 1 AND next_attempt_at <= ?", (now - self._sent_ttl,))
+                self._last_purge = now
+
+    def _db_retry(self, row_id: int, attempts: int, error: str, next_attempt_at: float) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE reply_outbox SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                (attempts, error, next_attempt_at, row_id),
+            )
+
+    def _db_dead_letter(self, row_id: int, attempts: int, error: str, now: float) -> None:
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO reply_dead_letters "
+                    "SELECT id, idempotency_key, phone_number, message_text, reply_context_id, ?, ?, created_at, ? "
+                    "FROM reply_outbox WHERE id = ?",
+                    (attempts, error, now, row_id),
+                )
+                self._db.execute("DELETE FROM reply_outbox WHERE id = ?", (row_id,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _db_stats(self, now: float) -> Dict[str, Any]:
+        with self._db_lock:
+            pending, oldest = self._db.execute("SELECT COUNT(*), MIN(created_at) FROM reply_outbox WHERE sent = 0").fetchone()
+            dead_letters = self._db.execute("SELECT COUNT(*) FROM reply_dead_letters").fetchone()[0]
+        return {
+            "pending": pending,
+            "oldest_pending_seconds": round(now - oldest, 1) if oldest else 0.0,
+            "sending": len(self._deliveries),
+            "dead_letters": dead_letters,
+        }
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Generic, List, Optional, TypeVar
+from logger import get_logger
+
+logger = get_logger()
+
+T = TypeVar("T")
+
+class KeyedScheduler(Generic[T]):
+    """
+    Runs items one at a time and in FIFO order per key, with different keys in parallel.
+
+    `run` appends the item to its key's backlog and returns; the first item for an idle key
+    starts a runner task for that key, which handles the backlog until it is empty. Callers
+    are never parked behind a conversation, and a semaphore capping how many items are
+    handled at once across all keys is the only limit on concurrency. Backlogs are bounded:
+    while `max_backlog` items are queued or running in total, or `max_backlog_per_key` are
+    queued for the item's key, `run` waits for room, which pushes back on whoever feeds the
+    scheduler. Callers waiting on the same key are let in in call order. Per-key state is
+    dropped as soon as a key's backlog is empty, so memory stays flat no matter how many
+    distinct keys pass through.
+
+    With a `coalesce_window`, the runner debounces before each turn: it keeps waiting
+    while new items keep arriving within the window (up to `coalesce_max_wait`), then
+    passes the whole backlog to the handler as one batch.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[T]], Awaitable[None]],
+        max_concurrency: int = 16,
+        coalesce_window: float = 0.0,
+        coalesce_max_wait: float = 5.0,
+        max_backlog: int = 1000,
+        max_backlog_per_key: int = 50,
+    ):
+        self._handler = handler
+        self._max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._coalesce_window = coalesce_window
+        self._coalesce_max_wait = coalesce_max_wait
+        self._max_backlog = max_backlog
+        self._max_backlog_per_key = max_backlog_per_key
+        self._backlogs: Dict[str, Deque[T]] = {}
+        self._runners: Dict[str, asyncio.Task] = {}
+        # Set and replaced whenever items finish, to wake callers waiting for room
+        self._room = asyncio.Event()
+        # Keys with callers waiting for room; they queue on the lock so the key's items keep their order
+        self._blocked: Dict[str, asyncio.Lock] = {}
+        self._blocked_callers: Dict[str, int] = {}
+        self._pending = 0
+        self._running = 0
+        self._failed = 0
+        self._items = 0
+        self._batches = 0
+
+    async def run(self, key: str, item: T) -> None:
+        """Queue an item for its key and return, once there is room in the backlogs"""
+        if key not in self._blocked and self._has_room(key):
+            self._enqueue(key, item)
+            return
+        lock = self._blocked.setdefault(key, asyncio.Lock())
+        self._blocked_callers[key] = self._blocked_callers.get(key, 0) + 1
+        try:
+            async with lock:
+                while not self._has_room(key):
+                    await self._room.wait()
+                self._enqueue(key, item)
+        finally:
+            self._blocked_callers[key] -= 1
+            if not self._blocked_callers[key]:
+                del self._blocked_callers[key]
+                del self._blocked[key]
+
+    def _enqueue(self, key: str, item: T) -> None:
+        self._pending += 1
+        backlog = self._backlogs.get(key)
+        if backlog is not None:
+            backlog.append(item)
+            return
+        backlog = self._backlogs[key] = deque([item])
+        self._runners[key] = asyncio.create_task(self._drain(key, backlog), name=f"scheduler-{key}")
+
+    async def stop(self, drain_timeout: Optional[float] = 30.0) -> None:
+        """Wait up to `drain_timeout` seconds for queued items to be handled, then cancel the runners"""
+        runners = list(self._runners.values())
+        if runners:
+            _, pending = await asyncio.wait(runners, timeout=drain_timeout)
+            if pending:
+                logger.warning(f"Scheduler drain timed out with {self._pending} items left")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _has_room(self, key: str) -> bool:
+        return self._pending < self._max_backlog and len(self._backlogs.get(key, ())) < self._max_backlog_per_key
+
+    async def _drain(self, key: str, backlog: Deque[T]) -> None:
+        try:
+            while backlog:
+                await self._debounce(backlog)
+                batch = list(backlog)
+                backlog.clear()
+                self._items += len(batch)
+                self._batches += 1
+                try:
+                    async with self._semaphore:
+                        self._running += 1
+                        try:
+                            await self._handler(batch)
+                        except Exception as e:
+                            self._failed += 1
+                            logger.error(f"Error processing {len(batch)} item(s) for {key}: {e}")
+                        finally:
+                            self._running -= 1
+                finally:
+                    self._release(len(batch))
+        finally:
+            self._release(len(backlog))
+            del self._backlogs[key]
+            del self._runners[key]
+
+    def _release(self, items: int) -> None:
+        self._pending -= items
+        self._room.set()
+        self._room = asyncio.Event()
+
+    async def _debounce(self, backlog: Deque[T]) -> None:
+        """Wait until no new item has arrived for a full window, or the max wait is reached"""
+        if self._coalesce_window <= 0:
+            return
+        deadline = time.monotonic() + self._coalesce_max_wait
+        while True:
+            seen = len(backlog)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(self._coalesce_window, remaining))
+            if len(backlog) == seen:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_keys": len(self._backlogs),
+            "pending": self._pending,
+            "max_backlog": self._max_backlog,
+            "running": self._running,
+            "max_concurrency": self._max_concurrency,
+            "failed": self._failed,
+            "items": self._items,
+            "batches": self._batches,
+            # Every item folded into an existing batch is one handler run (and LLM call) saved
+            "coalesced": self._items - self._batches,
+        }
@@ -0,0 +1,79 @@
+import importlib.util
+from typing import Any, Dict, List
+import httpx
+from fastapi import HTTPException
+from logger import get_logger
+from models import WatiApiResponse, WatiSendMessageRequest
+from utils.metrics import upstream_call
+
+logger = get_logger()
+
+# HTTP/2 needs the optional `h2` package (installed via `httpx[http2]`)
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+class WatiClient:
+    """
+    Long-lived WATI API client.
+
+    Wraps a single pooled `httpx.AsyncClient` so that connections to WATI are kept alive
+    and reused across webhooks instead of paying a TCP+TLS handshake per call. Base URL
+    and auth headers are set once. Create it at startup and `aclose()` it on shutdown.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_token: str,
+        http2: bool = True,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+    ):
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={
+                "Authorization": api_token,
+                "Content-Type": "application/json",
+            },
+            http2=http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+
+    async def send_session_message(self, data: WatiSendMessageRequest) -> WatiApiResponse:
+        """Send a session message to a WhatsApp number"""
+        params = {
+            "messageText": data.message_text,
+        }
+        if data.reply_context_id:
+            params["replyContextId"] = data.reply_context_id
+        
+        with upstream_call("wati", "send_session_message"):
+            response = await self._client.post(f"/sendSessionMessage/{data.phone_number}", params=params)
+            logger.info(f"Response from WATI: {response.status_code} ({len(response.content)} bytes)")
+            
+            if response.status_code == 200:
+                return WatiApiResponse(**response.json())
+            else:
+                raise HTTPException(status_code=response.status_code, detail=response.text)
+
+    async def get_messages(self, phone_number: str) -> List[Dict[str, Any]]:
+        """Get the raw message items for a WhatsApp number, newest first"""
+        with upstream_call("wati", "get_messages"):
+            response = await self._client.get(f"/getMessages/{phone_number}")
+            # The body is the whole chat history, so only its size is logged
+            logger.info(f"Response from WATI: {response.status_code} ({len(response.content)} bytes)")
+            
+            if response.status_code == 200:
+                return response.json().get('messages', {}).get('items', [])
+            else:
+                raise HTTPException(status_code=response.status_code, detail=response.text)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+from logger import get_logger
+
+logger = get_logger()
+
+T = TypeVar("T")
+
+class WorkQueue(Generic[T]):
+    """
+    Bounded asyncio work queue drained by a fixed pool of worker tasks.
+
+    `submit` never waits: when the queue is at `max_depth` the item is rejected and the
+    caller decides what to do (e.g. let the sender retry later). `stop` stops accepting
+    work, waits up to `drain_timeout` seconds for queued items to finish, then cancels
+    the workers.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[T], Awaitable[None]],
+        workers: int = 16,
+        max_depth: int = 1000,
+        name: str = "work-queue",
+    ):
+        self._handler = handler
+        self._workers = workers
+        self._name = name
+        self._queue: "asyncio.Queue[Tuple[T, float]]" = asyncio.Queue(maxsize=max_depth)
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+        self._busy = 0
+        self._enqueued = 0
+        self._rejected = 0
+        self._processed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def start(self) -> None:
+        self._accepting = True
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self._name}-{i}")
+            for i in range(self._workers)
+        ]
+
+    def submit(self, item: T) -> bool:
+        """Enqueue an item without waiting. Returns False if the queue is full or stopped."""
+        if not self._accepting:
+            self._rejected += 1
+            return False
+        try:
+            self._queue.put_nowait((item, time.monotonic()))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            logger.warning(f"{self._name} is full ({self._queue.maxsize} items), rejecting work")
+            return False
+        self._enqueued += 1
+        return True
+
+    async def stop(self, drain_timeout: Optional[float] = 30.0) -> None:
+        """Stop accepting work, drain what is queued, then cancel the workers"""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._name} drain timed out with {self._queue.qsize()} items left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Backpressure metrics"""
+        return {
+            "depth": self._queue.qsize(),
+            "max_depth": self._queue.maxsize,
+            "workers": self._workers,
+            "busy_workers": self._busy,
+            "enqueued": self._enqueued,
+            "rejected": self._rejected,
+            "processed": self._processed,
+            "failed": self._failed,
+            "avg_wait_seconds": self._total_wait / self._processed if self._processed else 0.0,
+            "max_wait_seconds": self._max_wait,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            item, enqueued_at = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._busy += 1
+            try:
+                await self._handler(item)
+            except Exception as e:
+                self._failed += 1
+                logger.error(f"{self._name} failed to process item: {e}")
+            finally:
+                self._processed += 1
+                self._busy -= 1
+                self._queue.task_done()